@@ -0,0 +1,182 @@
+"""
+Synthetic location data in the schema of the product queries.
+
+Usage: python -m bench.generate ROWS OUTPUT [--seed N] [--duplicate-rate R] ...
+"""
+import argparse
+import json
+import numpy as np
+import pandas as pd
+from lib.table_io import STRING_COLUMNS, write_table
+
+KINDS = ['Sporthal', 'Jeugdhuis', 'Cultuurcentrum', 'Bibliotheek', 'Museum', 'Zaal',
+         'Speelplein', 'Parochiezaal', 'Gemeenschapscentrum', 'Scoutslokaal', 'Chirolokaal',
+         'Zwembad', 'Kasteel', 'Theater', 'Muziekschool', 'Academie', 'Ontmoetingscentrum']
+NAMES = ["De Molen", "'t Hof", 'Ter Beke', 'De Kring', 'Het Park', 'De Linde', 'Sint-Jozef',
+         'De Brug', 'Den Engel', "'t Klooster", 'De Schakel', 'Ter Heide', 'De Wissel',
+         'Het Anker', 'De Zwaan', 'Sint-Pieter', 'De Kroon', 'Ten Bos', 'De Wijngaard',
+         'Het Spoor', 'De Horizon', 'Den Hert', "'t Gildenhuis", 'De Bron', 'Ter Dennen']
+STREETS = ['Kerkstraat', 'Stationsstraat', 'Dorpsstraat', 'Molenstraat', 'Nieuwstraat',
+           'Schoolstraat', 'Kapelstraat', 'Beekstraat', 'Veldstraat', 'Markt', 'Grote Markt',
+           'Kasteelstraat', 'Heidestraat', 'Bosstraat', 'Lindenlaan', 'Parklaan']
+CITIES = [('1000', 'Brussel'), ('2000', 'Antwerpen'), ('2200', 'Herentals'), ('2300', 'Turnhout'),
+          ('2800', 'Mechelen'), ('3000', 'Leuven'), ('3500', 'Hasselt'), ('3600', 'Genk'),
+          ('8000', 'Brugge'), ('8400', 'Oostende'), ('8500', 'Kortrijk'), ('8800', 'Roeselare'),
+          ('9000', 'Gent'), ('9100', 'Sint-Niklaas'), ('9200', 'Dendermonde'), ('9300', 'Aalst'),
+          ('9400', 'Ninove'), ('9700', 'Oudenaarde'), ('2440', 'Geel'), ('3800', 'Sint-Truiden')]
+SOURCES = [
+    "https://data.uitwisselingsplatform.be/"
+    "be.publiq.vrijetijdsparticipatie/publiq-uit-locaties/placessparql",
+    "https://data.uitwisselingsplatform.be/"
+    "be.dcjm.infrastructuur/jeugdmaps-infrastructuur/jeugdmapsinfra",
+    "https://data.uitwisselingsplatform.be/"
+    "be.dcjm.infrastructuur/kiosk-infrastructuur/infrastructuur",
+    "https://data.uitwisselingsplatform.be/"
+    "be.dcjm.infrastructuur/kampas-infrastructuur/kampasinfrastructuur",
+]
+
+# Default shares of the records:
+# duplicate - copies of another location under a new subject
+# typo - copies of another location with a typo in the name
+# repeat - repeated subjects, as query unions return them
+# missing_postcode - records without a postcode
+# unmapped - UiTdatabank records with a type missing from the mapping
+RATES = {'duplicate': 0.1, 'typo': 0.05, 'repeat': 0.05, 'missing_postcode': 0.05,
+         'unmapped': 0.1}
+
+def generate(rows, seed=0, mapping_json='conf/udbmappings.json', **rates):
+    """
+    Generate location records as returned by the product queries.
+    :param rows: The number of records.
+    :param seed: The random seed; the same arguments give the same records.
+    :param mapping_json: The UDB mapping file to draw location types from.
+    :param rates: Shares of the records overriding RATES, e.g. typo=0.1.
+    :return: A DataFrame with the query output columns.
+    """
+    rates = {**RATES, **rates}
+    rng = np.random.default_rng(seed)
+    with open(mapping_json, 'r', encoding='utf-8') as file:
+        mapping = json.load(file)
+
+    copies = [int(rows * rates[name]) for name in ('duplicate', 'typo', 'repeat')]
+    base = rows - sum(copies)
+    df = _locations(rng, base, mapping, rates)
+
+    # Copies of random locations; new subjects continue after the base ones
+    duplicates, typos, repeats = (df.iloc[rng.integers(0, base, count)].copy()
+                                  for count in copies)
+    duplicates['subject'] = _subjects(base, copies[0])
+    duplicates['bron'] = rng.choice(SOURCES, copies[0])
+    typos['subject'] = _subjects(base + copies[0], copies[1])
+    typos['locationName'] = _typos(rng, typos['locationName'].to_numpy())
+    repeats['gml'] = ''
+
+    df = pd.concat([df, duplicates, typos, repeats], ignore_index=True)
+    return df.iloc[rng.permutation(len(df))].reset_index(drop=True)
+
+def _subjects(start, count):
+    """Subject IRIs numbered from start."""
+    return [f"https://data.example.be/id/locatie/{number}"
+            for number in range(start, start + count)]
+
+def _locations(rng, rows, mapping, rates):
+    """Distinct locations, one per subject."""
+    streets, numbers = rng.choice(STREETS, rows), rng.integers(1, 250, rows).astype(str)
+    cities = np.array(CITIES)[rng.integers(0, len(CITIES), rows)]
+
+    # Postcodes go missing, or come back as floats from an earlier CSV round trip
+    postcodes = cities[:, 0].astype(object)
+    postcodes[rng.random(rows) < 0.02] += '.0'
+    postcodes[rng.random(rows) < rates['missing_postcode']] = np.nan
+
+    sources = rng.choice(len(SOURCES), rows, p=[0.5, 0.2, 0.2, 0.1])
+    udb_types, location_types = _types(rng, sources == 0, mapping, rates['unmapped'])
+
+    return pd.DataFrame({
+        'subject': _subjects(0, rows),
+        'locationName': _names(rng, rows),
+        'locationType': location_types,
+        'fullAddress': streets + ' ' + numbers + ', ' + cities[:, 0] + ' ' + cities[:, 1],
+        'thoroughfare': streets,
+        'huisnummer': numbers,
+        'busnummer': '',
+        'postCode': postcodes,
+        'city': cities[:, 1],
+        'gml': _points(rng, rows),
+        'point': '',
+        'bron': np.array(SOURCES)[sources],
+        'udbLocationType': udb_types,
+    }, columns=STRING_COLUMNS)
+
+def _names(rng, rows):
+    """Location names; some sources put the name first, others the kind, a few add a number."""
+    kinds, names = rng.choice(KINDS, rows), rng.choice(NAMES, rows)
+    location_names = np.where(rng.random(rows) < 0.3, names + ' ' + kinds,
+                              kinds + ' ' + names).astype(object)
+    numbered = rng.random(rows) < 0.2
+    location_names[numbered] += ' ' + rng.integers(2, 20, numbered.sum()).astype(str)
+
+    return location_names
+
+def _types(rng, publiq, mapping, unmapped_rate):
+    """
+    UiTdatabank types for publiq records, some missing from the mapping,
+    and infrastructure types for the other sources.
+    """
+    rows = len(publiq)
+    udb_types = np.array(list(mapping), dtype=object)[rng.integers(0, len(mapping), rows)]
+    unmapped = publiq & (rng.random(rows) < unmapped_rate)
+    udb_types[unmapped] = 'https://taxonomy.uitdatabank.be/terms/' + \
+        rng.integers(0, 1000, unmapped.sum()).astype(str)
+    udb_types[~publiq] = np.nan
+
+    location_types = np.array(list(mapping.values()), dtype=object)[
+        rng.integers(0, len(mapping), rows)]
+    location_types[publiq] = ''
+
+    return udb_types, location_types
+
+def _points(rng, rows):
+    """GML points in Belgian Lambert 72 for about half of the records."""
+    x = np.char.mod('%.2f', rng.uniform(22000, 258000, rows))
+    y = np.char.mod('%.2f', rng.uniform(153000, 244000, rows))
+    points = '<gml:Point srsName="http://www.opengis.net/def/crs/EPSG/0/31370">' \
+        '<gml:coordinates>' + x + ',' + y + '</gml:coordinates></gml:Point>'
+
+    return np.where(rng.random(rows) < 0.5, points, '').astype(object)
+
+def _typos(rng, names):
+    """Apply one random edit to every name: swap, drop, double or replace a letter."""
+    edited = []
+    for name, edit, where in zip(names, rng.integers(0, 4, len(names)),
+                                 rng.random(len(names))):
+        i = int(where * (len(name) - 1))
+        if edit == 0:
+            name = name[:i] + name[i + 1] + name[i] + name[i + 2:]
+        elif edit == 1:
+            name = name[:i] + name[i + 1:]
+        elif edit == 2:
+            name = name[:i] + name[i] + name[i:]
+        else:
+            name = name[:i] + 'aeiou'[int(where * 1000) % 5] + name[i + 1:]
+        edited.append(name)
+
+    return edited
+
+def main():
+    """Write a synthetic input file."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('rows', type=int, help='the number of records.')
+    parser.add_argument('output', help='the file to write (.csv or .parquet).')
+    parser.add_argument('--seed', type=int, default=0, help='the random seed.')
+    for name, rate in RATES.items():
+        parser.add_argument(f"--{name.replace('_', '-')}-rate", type=float, default=rate,
+                            help=f"share of {name.replace('_', ' ')} records.")
+    args = parser.parse_args()
+
+    write_table(generate(args.rows, args.seed,
+                         **{name: getattr(args, f"{name}_rate") for name in RATES}),
+                args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+A local SPARQL endpoint that serves a fixed result, for fetch benchmarks and tests.
+"""
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+import pandas as pd
+from lib.sparql_results import MEDIA_TYPES
+
+COUNT = re.compile(r'COUNT\(\*\)\s+AS\s+\?count', re.IGNORECASE)
+WINDOW = re.compile(r'LIMIT\s+(\d+)\s+OFFSET\s+(\d+)\s*$', re.IGNORECASE)
+
+def encode_results(df, result_format):
+    """Encode a DataFrame as a SPARQL result in JSON, CSV or TSV format."""
+    if result_format == 'json':
+        bindings = [{var: {'type': 'uri' if var == 'subject' else 'literal', 'value': value}
+                     for var, value in row.items() if isinstance(value, str)}
+                    for row in df.to_dict('records')]
+        return json.dumps({'head': {'vars': list(df.columns)},
+                           'results': {'bindings': bindings}}).encode('utf-8')
+
+    if result_format == 'csv':
+        return df.to_csv(index=False).encode('utf-8')
+
+    # TSV holds RDF terms: <iri> for subjects and quoted, escaped literals
+    header = '?' + '\t?'.join(df.columns)
+    terms = []
+    for column in df.columns:
+        values = df[column].dropna()
+        values = '<' + values + '>' if column == 'subject' else \
+            '"' + values.str.replace('\\', '\\\\', regex=False) \
+            .str.replace('"', '\\"', regex=False).str.replace('\t', '\\t', regex=False) \
+            .str.replace('\n', '\\n', regex=False) + '"'
+        terms.append(values.reindex(df.index, fill_value=''))
+
+    rows = terms[0].str.cat(terms[1:], sep='\t')
+    return (header + '\n' + '\n'.join(rows) + '\n').encode('utf-8')
+
+class MockEndpoint:
+    """
+    MockEndpoint serves one DataFrame as the result of every query, in the
+    format the Accept header asks for, from a thread on a free local port.
+    The bodies are encoded up front so only transfer and parsing are timed.
+
+    For fetch tests it also answers COUNT(*) probes with the row count and
+    LIMIT/OFFSET queries with that window of the rows, sends an ETag and
+    304 Not Modified when one is set, and answers the next requests with
+    the status codes queued in failures. Every request is kept in requests.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, df, result_formats=tuple(MEDIA_TYPES), etag=None):
+        self.result_formats = result_formats
+        self.failures = []
+        self.requests = []
+        self.set_data(df, etag)
+        endpoint = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """Answer every POST with the encoded result."""
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):  # pylint: disable=invalid-name
+                """Serve the body for the requested media type."""
+                form = parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode())
+                query = form.get('query', [''])[0]
+                endpoint.requests.append((query, dict(self.headers)))
+                status, headers, body = endpoint.respond(
+                    query, self.headers.get('Accept', MEDIA_TYPES['json']),
+                    self.headers.get('If-None-Match'))
+
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                for start in range(0, len(body), 1 << 16):
+                    self.wfile.write(body[start:start + (1 << 16)])
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/sparql"
+
+    def set_data(self, df, etag=None):
+        """Serve other rows from now on, optionally with an ETag."""
+        self.df = df
+        self.etag = etag
+        self.bodies = {MEDIA_TYPES[result_format]: encode_results(df, result_format)
+                       for result_format in self.result_formats}
+
+    def respond(self, query, media_type, if_none_match=None):
+        """The status, headers and body of the answer to a query."""
+        if self.failures:
+            return self.failures.pop(0), {}, b'unavailable'
+
+        headers = {'ETag': self.etag} if self.etag else {}
+        if self.etag and if_none_match == self.etag:
+            return 304, headers, b''
+
+        result_format = next(name for name, media in MEDIA_TYPES.items() if media == media_type)
+        if COUNT.search(query):
+            return 200, headers, encode_results(
+                pd.DataFrame({'count': [str(len(self.df))]}), result_format)
+
+        window = WINDOW.search(query)
+        if window:
+            limit, offset = int(window.group(1)), int(window.group(2))
+            return 200, headers, encode_results(
+                self.df.iloc[offset:offset + limit], result_format)
+
+        return 200, headers, self.bodies[media_type]
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def body(self, result_format):
+        """The encoded result in a format, for parsing without the network."""
+        return self.bodies[MEDIA_TYPES[result_format]]
+
+def chunked(body, size=1 << 16):
+    """Split a body into chunks like a streamed response."""
+    return (body[start:start + size] for start in range(0, len(body), size))
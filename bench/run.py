@@ -0,0 +1,222 @@
+"""
+Benchmarks of the ETL stages, merging and fetching on synthetic data.
+
+Usage:
+    python -m bench.run --sizes 10k 100k --save reference
+    python -m bench.run --sizes 10k 100k --compare reference
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+import httpx
+import numpy as np
+import pandas as pd
+from bench.generate import generate
+from bench.mock_endpoint import MockEndpoint, chunked
+from lib.data_cruncher import DataCruncher
+from lib.etl_pipeline import ETLPipeline
+from lib.linked_data_api import LinkedDataAPI
+from lib.profiler import StageProfiler
+from lib.sparql_results import MEDIA_TYPES, parse_results
+from lib.stage_pipeline import StagePipeline
+from lib.table_io import read_table, write_table
+
+SIZES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000, '5m': 5_000_000}
+SUITES = ['etl', 'merge', 'fetch']
+DATA_DIR = 'bench/data'
+BASELINE_DIR = 'bench/baselines'
+
+def input_file(rows, seed):
+    """The generated input of a size, written on first use."""
+    path = os.path.join(DATA_DIR, f"locations-{rows}-{seed}.csv")
+    if not os.path.exists(path):
+        os.makedirs(DATA_DIR, exist_ok=True)
+        write_table(generate(rows, seed), path)
+
+    return path
+
+def bench_etl(path, workers=None):
+    """Time every ETL stage and deduplication step."""
+    pipeline = ETLPipeline(path, 'conf/udbmappings.json', 'conf/to_remove.txt')
+    pipeline.profiler = StageProfiler()
+
+    pipeline.profiler.start()
+    for _ in StagePipeline(pipeline, None, {'workers': workers}).run():
+        pass
+    pipeline.profiler.stop()
+
+    return _wall_times(pipeline.profiler.stages, 'etl')
+
+def _wall_times(records, prefix):
+    """Flatten nested profiler records to {'prefix.stage.step': seconds}."""
+    times = {}
+    for record in records:
+        name = f"{prefix}.{record['name']}"
+        times[name] = record['wall_seconds']
+        times.update(_wall_times(record['steps'], name))
+
+    return times
+
+def bench_merge(path, parts=4):
+    """Time merging the input split over several files, at once and in chunks."""
+    df = read_table(path)
+    times = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+        files = []
+        for number, part in enumerate(np.array_split(np.arange(len(df)), parts)):
+            files.append(os.path.join(directory, f"part-{number}.csv"))
+            write_table(df.iloc[part], files[-1])
+
+        output = os.path.join(directory, 'merged.csv')
+        times['merge'] = _timed(DataCruncher.merge, files, output)
+        times['merge.chunked'] = _timed(DataCruncher.merge, files, output,
+                                        max(len(df) // 10, 1000))
+
+    return times
+
+def bench_fetch(path):
+    """Time parsing every result format, in memory and from a local endpoint."""
+    df = read_table(path)
+    times = {}
+
+    with MockEndpoint(df) as endpoint, httpx.Client() as client:
+        api = LinkedDataAPI(client)
+        api.set_data_endpoint(endpoint.url)
+        api.set_query('SELECT * WHERE { ?subject ?p ?o }')
+
+        for result_format in MEDIA_TYPES:
+            body = endpoint.body(result_format)
+            times[f"parse.{result_format}"] = _timed(
+                lambda body=body, result_format=result_format:
+                parse_results(chunked(body), result_format))
+
+            api.set_result_format(result_format)
+            times[f"fetch.{result_format}"] = _timed(api.fetch_data)
+
+    return times
+
+def _timed(function, *args):
+    """Wall time of one call."""
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+def run(sizes, suites=tuple(SUITES), repeat=3, seed=0, workers=None):
+    """
+    Run the benchmarks.
+    :param sizes: The input sizes, keys of SIZES.
+    :param suites: The suites to run, from SUITES.
+    :param repeat: Runs per benchmark; the fastest run counts.
+    :param seed: The seed of the generated inputs.
+    :param workers: The worker processes for the deduplication.
+    :return: A dict of {size: {benchmark: seconds}}.
+    """
+    results = {}
+    for size in sizes:
+        path = input_file(SIZES[size], seed)
+        results[size] = {}
+
+        for suite in suites:
+            for _ in range(repeat):
+                if suite == 'etl':
+                    times = bench_etl(path, workers)
+                elif suite == 'merge':
+                    times = bench_merge(path)
+                else:
+                    times = bench_fetch(path)
+
+                for name, seconds in times.items():
+                    results[size][name] = min(seconds, results[size].get(name, seconds))
+
+            print(f"{size} {suite}: done", file=sys.stderr)
+
+    return results
+
+def environment():
+    """What the timings were measured on."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {'date': datetime.now(timezone.utc).isoformat(), 'commit': commit,
+            'python': platform.python_version(), 'pandas': pd.__version__,
+            'numpy': np.__version__, 'machine': platform.machine(),
+            'system': platform.system(), 'cpus': os.cpu_count()}
+
+def compare(results, baseline, threshold=1.2, noise=0.05):
+    """
+    Print every benchmark against the baseline.
+    :return: The names of the benchmarks slower than threshold times the
+        baseline by more than noise seconds.
+    """
+    regressions = []
+    print(f"{'benchmark':40} {'baseline':>10} {'current':>10} {'ratio':>7}")
+
+    for size, times in results.items():
+        for name, seconds in times.items():
+            before = baseline.get(size, {}).get(name)
+            if before is None:
+                continue
+
+            ratio = seconds / before if before else float('inf')
+            slower = ratio > threshold and seconds - before > noise
+            if slower:
+                regressions.append(f"{size} {name}")
+            print(f"{size + ' ' + name:40} {before:10.3f} {seconds:10.3f} {ratio:7.2f}"
+                  f"{'  slower' if slower else ''}")
+
+    return regressions
+
+def main():
+    """Run the benchmarks, save them as a baseline or compare them with one."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', nargs='+', default=['10k', '100k'], choices=list(SIZES),
+                        help='the input sizes to run.')
+    parser.add_argument('--suites', nargs='+', default=SUITES, choices=SUITES,
+                        help='the benchmark suites to run.')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per benchmark; the fastest run counts.')
+    parser.add_argument('--seed', type=int, default=0, help='the seed of the generated inputs.')
+    parser.add_argument('--processes', type=int,
+                        help='number of processes for the deduplication.')
+    parser.add_argument('--output', help='write the results as JSON to this file.')
+    parser.add_argument('--save', help='save the results as the named baseline.')
+    parser.add_argument('--compare', help='compare the results with the named baseline.')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='slowdown ratio reported as a regression.')
+    args = parser.parse_args()
+
+    report = {'environment': environment(),
+              'results': run(args.sizes, args.suites, args.repeat, args.seed, args.processes)}
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+
+    if args.save:
+        with open(os.path.join(BASELINE_DIR, f"{args.save}.json"), 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+
+    if args.compare:
+        with open(os.path.join(BASELINE_DIR, f"{args.compare}.json"), 'r',
+                  encoding='utf-8') as file:
+            baseline = json.load(file)
+
+        regressions = compare(report['results'], baseline['results'], args.threshold)
+        if regressions:
+            print(f"Slower than {args.compare}: {', '.join(regressions)}")
+            sys.exit(1)
+    elif not args.output:
+        print(json.dumps(report['results'], indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""
+Out-of-core execution of the ETL pipeline for inputs that do not fit in memory.
+"""
+import os
+import tempfile
+from contextlib import ExitStack
+import numpy as np
+import pandas as pd
+from lib.disjoint_set import DisjointSet
+from lib.etl_pipeline import HASH_COLUMNS, ETLPipeline, fuzzy_rows, hashes_path
+from lib.table_io import TableWriter, iter_table, read_table, write_table
+
+class ChunkedETL:
+    """
+    ChunkedETL streams the input in chunks through the row-local stages,
+    spills the rows to hash partitions on disk and runs the grouping and
+    deduplication one partition at a time, so memory follows the chunk and
+    partition size instead of the input size.
+
+    Grouping is exact, since partitions are split by subject. Deduplication
+    is split by postCode, which every exact-key subset contains, and every
+    partition is sorted by subject like the grouped data in memory. Fuzzy
+    name pairs are resolved once from the first rows of every name in all
+    partitions, and the duplicate links are clustered over all partitions,
+    so the output is that of the in-memory pipeline. Only nearby locations
+    are looked for within a partition, so with --geo-radius the output
+    depends on the number of partitions.
+
+    Besides a chunk or partition, memory holds the distinct location names
+    and the duplicate links.
+    """
+
+    # pylint: disable=too-few-public-methods
+    def __init__(self, pipeline: ETLPipeline, chunksize: int, partitions: int = 16):
+        self.pipeline = pipeline
+        self.chunksize = chunksize
+        self.partitions = partitions
+
+    def run(self, output, quarantine_mode='substring', spill_dir=None):
+        """
+        Run the pipeline from the pipeline's input file to the output file.
+        :param output: The CSV or Parquet file to write.
+        :param quarantine_mode: The mode passed to ETLPipeline.remove.
+        :param spill_dir: Where to create the temporary partition files.
+        :return: A dict with the record counts after each stage.
+        """
+        counts = {'initial': 0, 'filtered': 0, 'quarantined': 0, 'grouped': 0}
+        certainty = []
+
+        with tempfile.TemporaryDirectory(dir=spill_dir) as spill:
+            # Pass 1: filter and quarantine per chunk, partition by subject
+            subjects = self._partition(
+                spill, 'subject', self._filtered_chunks(counts, quarantine_mode), 'subject')
+
+            # Pass 2: group and clean per subject partition, partition by postCode
+            postcodes = self._partition(
+                spill, 'postcode', self._grouped_partitions(subjects, counts), 'postCode')
+
+            # Pass 3: exact-key deduplication per postCode partition
+            links = []
+            rows = self._exact_partitions(spill, postcodes, links)
+
+            # Pass 4: fuzzy and geospatial matching per partition, with the
+            # fuzzy pairs resolved over all partitions
+            try:
+                if rows:
+                    self.pipeline.resolve_fuzzy_pairs(pd.concat(rows, ignore_index=True))
+                certainty = self._matched_partitions(spill, postcodes, links)
+            finally:
+                self.pipeline.resolved_fuzzy_pairs = None
+
+            # Pass 5: cluster the links of all partitions and write the output
+            clusters = _Clusters(pd.concat(links, ignore_index=True) if links else None,
+                                 postcodes)
+            with TableWriter(output) as writer, TableWriter(hashes_path(output)) as hashes:
+                for path in postcodes:
+                    self.pipeline.data = read_table(path)
+                    self.pipeline.apply_schema()
+                    clusters.assign(self.pipeline.data)
+                    writer.write(self.pipeline.data.drop(columns='content_hash'))
+                    hashes.write(self.pipeline.data[HASH_COLUMNS])
+
+        counts['certainty'] = pd.concat(certainty).groupby(level=0).sum() \
+            if certainty else pd.Series(dtype=int)
+
+        return counts
+
+    def _exact_partitions(self, spill, paths, links):
+        """Run the exact-key phase on every partition in place, return their fuzzy rows."""
+        rows = []
+        for number, path in enumerate(paths):
+            # In memory the grouped data is sorted by subject too, which
+            # decides the first subject of every group of duplicates
+            self.pipeline.data = read_table(path).sort_values('subject', ignore_index=True)
+            self.pipeline.apply_schema()
+            with self.pipeline.profile('dedup'):
+                self.pipeline.deduplicate_data(phases=('exact',))
+
+            links.append(self.pipeline.duplicate_links)
+            rows.append(fuzzy_rows(self.pipeline.data))
+            paths[number] = os.path.join(spill, f"exact-{number}.parquet")
+            write_table(self.pipeline.data, paths[number])
+
+        return rows
+
+    def _matched_partitions(self, spill, paths, links):
+        """Run the matching phase on every partition in place, return the certainty counts."""
+        certainty = []
+        for number, path in enumerate(paths):
+            self.pipeline.data = read_table(path)
+            self.pipeline.apply_schema()
+            with self.pipeline.profile('dedup'):
+                certainty.append(self.pipeline.deduplicate_data(phases=('matching',)))
+
+            links.append(self.pipeline.duplicate_links)
+            paths[number] = os.path.join(spill, f"matched-{number}.parquet")
+            write_table(self.pipeline.data, paths[number])
+
+        return certainty
+
+    def _filtered_chunks(self, counts, quarantine_mode):
+        """Yield the input chunks after the row-local filter and quarantine stages."""
+        for chunk in iter_table(self.pipeline.input_csv, self.chunksize):
+            counts['initial'] += len(chunk)
+
+            self.pipeline.data = chunk
+            self.pipeline.apply_schema()
+            counts['filtered'] += self.pipeline.filter_udb_location_type()
+
+            # Quarantine works on subjects, so it can run before grouping
+            counts['quarantined'] += self.pipeline.remove(quarantine_mode)
+
+            yield self.pipeline.data
+
+    def _grouped_partitions(self, paths, counts):
+        """Yield every subject partition grouped, cleaned and with filled location types."""
+        for path in paths:
+            self.pipeline.data = read_table(path)
+            self.pipeline.apply_schema()
+            counts['grouped'] += self.pipeline.group_by_id()
+            self.pipeline.hash_rows()
+            self.pipeline.advanced_cleanup_strings()
+            self.pipeline.fill_empty_location_type()
+
+            yield self.pipeline.data
+
+    def _partition(self, spill, name, frames, column):
+        """
+        Spill frames to partition files by a hash of one column.
+        :return: The paths of the non-empty partitions.
+        """
+        paths = [os.path.join(spill, f"{name}-{number}.parquet")
+                 for number in range(self.partitions)]
+
+        with ExitStack() as stack:
+            writers = [stack.enter_context(TableWriter(path)) for path in paths]
+
+            for frame in frames:
+                keys = pd.util.hash_pandas_object(frame[column], index=False) % self.partitions
+                for number, part in frame.groupby(keys.to_numpy()):
+                    writers[number].write(part)
+
+        return [path for path in paths if os.path.exists(path)]
+
+class _Clusters:
+    """
+    The clusters of the duplicate links of all partitions, as in
+    ETLPipeline._cluster_duplicates: the smallest subject of a cluster is
+    its canonical subject and its highest certainty the cluster certainty.
+    Only linked subjects are kept; every other subject is a cluster alone.
+    """
+
+    # pylint: disable=too-few-public-methods
+    def __init__(self, links, paths):
+        links = links if links is not None else \
+            pd.DataFrame(columns=['subject', 'duplicate_subject'], dtype=object)
+        # Sorted, so the smallest position in a cluster is its smallest subject
+        self.subjects = pd.Index(np.unique(links.to_numpy(dtype=object).ravel()))
+        forest = DisjointSet(len(self.subjects))
+        forest.union(self.subjects.get_indexer(links['subject']),
+                     self.subjects.get_indexer(links['duplicate_subject']))
+
+        self.roots = forest.find(np.arange(len(self.subjects)))
+        self.canonical = self.subjects.to_numpy()[
+            pd.Series(np.arange(len(self.subjects))).groupby(self.roots).transform('min')]
+
+        # The highest certainty per cluster, from the subject and certainty columns only
+        self.certainty = np.full(len(self.subjects), -np.inf)
+        for path in paths:
+            part = pd.read_parquet(path, columns=['subject', 'certainty_ratio'])
+            codes = self.subjects.get_indexer(part['subject'])
+            linked = codes >= 0
+            np.maximum.at(self.certainty, self.roots[codes[linked]],
+                          part['certainty_ratio'].to_numpy()[linked])
+
+    def assign(self, df):
+        """Add the cluster columns to a partition."""
+        codes = self.subjects.get_indexer(df['subject'])
+        linked = codes >= 0
+
+        canonical = df['subject'].to_numpy(dtype=object).copy()
+        canonical[linked] = self.canonical[codes[linked]]
+        certainty = df['certainty_ratio'].to_numpy(dtype=float).copy()
+        certainty[linked] = self.certainty[self.roots[codes[linked]]]
+
+        df['canonical_subject'] = canonical
+        df['cluster_id'] = pd.util.hash_pandas_object(df['canonical_subject'], index=False)
+        df['cluster_certainty'] = certainty
@@ -1,7 +1,9 @@
 """
-Utility module for merging multiple CSV files into one.
+Utility module for merging multiple CSV or Parquet files into one.
 """
+import numpy as np
 import pandas as pd
+from lib.table_io import TableWriter, iter_table, read_table, write_table
 
 class DataCruncher:
     """
@@ -13,21 +15,84 @@ class DataCruncher:
         pass
 
     @staticmethod
-    def merge(csv_files: list):
+    def merge(csv_files: list, output: str = 'merged.csv', chunksize: int = None):
         """
-        Merge multiple CSV files into one.
+        Merge multiple CSV files into one. Files ending in .parquet are
+        read and written as Parquet.
         :param csv_files: A list of CSV file paths.
+        :param output: The path of the merged file.
+        :param chunksize: Stream the files in chunks of this many rows.
         """
+        if chunksize:
+            DataCruncher._merge_chunked(csv_files, output, chunksize)
+            return
+
         # Initialize an empty list to store the dataframes
         dataframes = []
 
         # Loop through the list of CSV files
         for csv_file in csv_files:
             # Read each CSV file into a DataFrame and append it to the list
-            dataframes.append(pd.read_csv(csv_file))
+            dataframes.append(read_table(csv_file))
 
         # Concatenate all the dataframes into one
         merged_df = pd.concat(dataframes)
 
-        # Save the merged dataframe to a new CSV file
-        merged_df.to_csv('merged.csv', index=False)
+        # Save the merged dataframe to a new file
+        write_table(merged_df, output)
+
+    @staticmethod
+    def _merge_chunked(csv_files, output, chunksize):
+        """
+        Merge CSV files while holding one chunk in memory at a time.
+        A first pass collects the union schema and the dtypes a full read
+        and concat would end up with, so the output bytes are the same.
+        """
+        # Pass 1: the dtype each file gets when read at once
+        file_dtypes = []
+        for csv_file in csv_files:
+            dtypes = {}
+            for chunk in iter_table(csv_file, chunksize):
+                for column, dtype in chunk.dtypes.items():
+                    dtypes[column] = _common_dtype([dtypes.get(column, dtype), dtype])
+            file_dtypes.append(dtypes)
+
+        # Union of the columns in order of appearance, as pd.concat aligns them
+        columns = list(dict.fromkeys(column for dtypes in file_dtypes for column in dtypes))
+        merged_dtypes = {
+            column: _common_dtype([dtypes[column] for dtypes in file_dtypes if column in dtypes],
+                                  missing=any(column not in dtypes for dtypes in file_dtypes))
+            for column in columns}
+
+        # Pass 2: cast every chunk to the merged schema and append it
+        with TableWriter(output) as writer:
+            for csv_file, dtypes in zip(csv_files, file_dtypes):
+                # Text columns are read as text, whatever a single chunk looks like
+                text_columns = {column: str for column, dtype in dtypes.items()
+                                if not _is_numeric(dtype)}
+
+                for chunk in iter_table(csv_file, chunksize, text_columns):
+                    chunk = chunk.reindex(columns=columns)
+                    for column, dtype in merged_dtypes.items():
+                        if _is_numeric(dtype) and chunk[column].dtype != dtype:
+                            chunk[column] = chunk[column].astype(dtype)
+
+                    writer.write(chunk)
+
+def _is_numeric(dtype):
+    """Whether a dtype is a plain numpy int, unsigned or float dtype."""
+    return isinstance(dtype, np.dtype) and dtype.kind in 'iuf'
+
+def _common_dtype(dtypes, missing=False):
+    """
+    The dtype pandas gives a column when values of these dtypes are put
+    together; missing means some parts lack the column and add NaN.
+    """
+    if all(_is_numeric(dtype) for dtype in dtypes):
+        dtype = np.result_type(*dtypes)
+        return np.dtype('float64') if missing and dtype.kind in 'iu' else dtype
+
+    if len(set(dtypes)) == 1 and not (missing and dtypes[0] == np.dtype(bool)):
+        return dtypes[0]
+
+    return np.dtype(object)
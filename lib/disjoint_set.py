@@ -0,0 +1,53 @@
+"""
+Array-backed disjoint-set forest used to cluster duplicate records.
+"""
+import numpy as np
+
+class DisjointSet:
+    """
+    DisjointSet keeps one parent pointer per element in a numpy array and
+    merges whole batches of links at once instead of one pair at a time.
+    """
+
+    def __init__(self, size: int):
+        self.parent = np.arange(size)
+
+    def find(self, items):
+        """
+        Find the root of each item.
+        :param items: An array of element positions.
+        :return: An array with the root of every item.
+        """
+        # Pointer doubling on the whole forest: every pass makes each element
+        # point at its grandparent, halving all paths until they reach a root
+        parent = self.parent
+        while True:
+            grand = parent[parent]
+            if np.array_equal(grand, parent):
+                break
+            parent = grand
+        self.parent = parent
+
+        return parent[items]
+
+    def union(self, left, right):
+        """
+        Merge the sets of each left[i] and right[i] pair.
+        :param left: An array of element positions.
+        :param right: An array of element positions, same length as left.
+        """
+        left = np.asarray(left)
+        right = np.asarray(right)
+
+        while True:
+            left_roots = self.find(left)
+            right_roots = self.find(right)
+            differ = left_roots != right_roots
+            if not differ.any():
+                return
+
+            # Hook the larger root under the smaller one, so parents only ever
+            # decrease and no cycles can form; conflicting hooks keep the minimum
+            low = np.minimum(left_roots[differ], right_roots[differ])
+            high = np.maximum(left_roots[differ], right_roots[differ])
+            np.minimum.at(self.parent, high, low)
@@ -1,145 +1,432 @@
 """ETL pipeline for data cleansing and transformation."""
+import contextlib
+import functools
+import itertools
+import os
 import re
 import json
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
 from rapidfuzz import fuzz, process
+from lib.disjoint_set import DisjointSet
+from lib.geometry import GridIndex, points
+from lib.schema import like, to_categorical
+from lib.table_io import read_table, write_table
+from lib.udb_mapping import UdbMapping
+
+# The phases of ETLPipeline.deduplicate_data
+DEDUPLICATION_PHASES = ('exact', 'matching', 'cluster')
+
+# Columns of the side file that keeps the content hash of every output row
+HASH_COLUMNS = ['subject', 'content_hash']
+
+DIGITS = re.compile(r'\d')
+INVALID_CHARACTERS = re.compile(r'[?/-]')
+WHITESPACE = re.compile(r'\s+')
+SPECIAL_QUOTES = str.maketrans({'’': "'", '‘': "'", '“': '"', '”': '"'})
+
+def hashes_path(output):
+    """The Parquet side file with the content hashes of an output file."""
+    return f"{os.path.splitext(output)[0]}.hashes.parquet"
+
+def _map_unique(series, clean):
+    """Apply a vectorized clean function once per distinct value of a series."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # Clean the categories; cleaning can merge some, so build new ones
+        cleaned = clean(pd.Series(series.cat.categories, dtype=object)).to_numpy()
+        return pd.Series(cleaned[series.cat.codes], index=series.index) \
+            .where(series.notna()).astype('category')
+
+    # Location names and postcodes repeat heavily across sources
+    codes, uniques = pd.factorize(series)
+    cleaned = clean(pd.Series(uniques))
+
+    missing = codes < 0
+    if missing.any():
+        # factorize takes None and NaN for the same value, while cleaning
+        # turns them into 'None' and 'nan'; missing values are cleaned as they are
+        codes = np.where(missing, len(uniques) + np.cumsum(missing) - 1, codes)
+        cleaned = pd.concat([cleaned, clean(series[missing].reset_index(drop=True))],
+                            ignore_index=True)
+
+    # Keep the column's dtype, so a checkpoint round trip restores it as it was
+    return cleaned.take(codes).set_axis(series.index).astype(series.dtype)
+
+def _clean_location_names(names):
+    """Clean location names based on the specified rules."""
+    # Object dtype keeps Python's str semantics for every .str call below
+    names = pd.Series(names.map(str), dtype=object)
+
+    # Remove integers
+    names = names.str.replace(DIGITS, '', regex=True)
+
+    # Replace special quotes with standard quotes
+    names = names.str.translate(SPECIAL_QUOTES)
+
+    # Replace 'T with 't and handle HTML escaped characters
+    for escaped in ["'T", "&#039;t", "&#;t"]:
+        names = names.str.replace(escaped, "'t", regex=False)
+
+    # Remove ' / ? if they are the only characters in the string
+    names = names.mask(names.isin(["'", "/", "?"]), "")
+
+    # Remove invalid characters (?, /, -) and leading/trailing whitespace
+    names = names.str.replace(INVALID_CHARACTERS, ' ', regex=True).str.strip()
+
+    # Replace multiple spaces with a single space
+    names = names.str.replace(WHITESPACE, ' ', regex=True)
+
+    # Remove single or double quotes from both ends of a string
+    # if the string starts and ends with either.
+    quoted = (names.str.startswith("'") & names.str.endswith("'")) | \
+        (names.str.startswith('"') & names.str.endswith('"'))
+
+    return names.mask(quoted, names.str[1:-1])
+
+def _replace_decimal_zeros(values):
+    """Remove a trailing '.0' from postcodes that were read as floats."""
+    if not (pd.api.types.is_object_dtype(values) or pd.api.types.is_string_dtype(values)):
+        return values
+
+    def strip_decimal_zero(value):
+        try:
+            # Convert to integer and then to string to remove .0
+            return str(int(float(value)))
+        except ValueError:
+            # If the conversion fails, return the original value
+            return value
+
+    decimal = values.str.endswith('.0', na=False)
+
+    return values.mask(decimal, values[decimal].map(strip_decimal_zero))
+
+def _file_stamp(path):
+    """The modification time and size of a file, so caches see when it changes."""
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+# Parsed configuration files and quarantine patterns are cached per process,
+# so a long-lived worker only reads and compiles them again after a change
+@functools.lru_cache(maxsize=8)
+def _read_mapping(path, _stamp):
+    """The UDB mapping of a JSON file."""
+    with open(path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+@functools.lru_cache(maxsize=8)
+def _read_quarantine(path, _stamp):
+    """The non-empty lines of a quarantine file."""
+    with open(path, 'r', encoding='UTF-8') as file:
+        return frozenset(line.strip() for line in file if line.strip())
+
+@functools.lru_cache(maxsize=8)
+def _trie_pattern(strings):
+    """Compile literal strings into one regex that follows their shared prefixes."""
+    trie = {}
+    for string in strings:
+        node = trie
+        for char in string:
+            node = node.setdefault(char, {})
+        # An empty key marks the end of a string
+        node[''] = {}
+
+    def build(node):
+        branches = [re.escape(char) + build(child)
+                    for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        pattern = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+
+        return f"(?:{pattern})?" if '' in node else pattern
+
+    return re.compile(build(trie))
+
+def _first_non_empty(values, subjects, first):
+    """The first value per subject that is neither missing nor empty."""
+    return values.mask(values.eq('')).groupby(subjects, observed=True).first().fillna(first)
+
+def _concat_distinct(values, subjects, first, separator=' | '):
+    """The distinct non-empty values per subject in order of appearance, joined."""
+    pairs = pd.DataFrame({'subject': subjects, 'value': values.astype(object)}).dropna()
+    pairs = pairs[pairs['value'].ne('')].drop_duplicates().sort_values('subject', kind='stable')
+
+    # Sum the strings of every subject's run of rows in one reduceat call
+    keys = pairs['subject'].to_numpy(dtype=object)
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else []
+    joined = np.add.reduceat(pairs['value'].to_numpy(dtype=object) + separator, starts) \
+        if len(keys) else np.empty(0, dtype=object)
+
+    return pd.Series(joined, index=keys[starts], dtype=object).str[:-len(separator)] \
+        .reindex(first.index).fillna(first)
+
+# Aggregations for group_by_id besides pandas' 'first', which takes the
+# first non-missing value. Each gets a column, its subjects and the 'first'
+# result, and runs vectorized over the whole column.
+AGGREGATIONS = {'first': None, 'first_non_empty': _first_non_empty,
+                'concat_distinct': _concat_distinct}
+
+def _aggregate(df, rules):
+    """Group rows by subject, with 'first' or the named aggregation per column."""
+    grouped = df.groupby('subject', observed=True).agg(
+        {column: 'first' for column in df.columns if column != 'subject'})
+
+    for column, rule in rules.items():
+        if column in grouped and AGGREGATIONS[rule] is not None:
+            grouped[column] = like(AGGREGATIONS[rule](df[column], df['subject'],
+                                                      grouped[column]), df[column])
+
+    return grouped.reset_index()
+
+def _colocated(x, y, names):
+    """The group of rows with the same point and name per row, and the first row per group."""
+    groups = pd.DataFrame({'x': x, 'y': y, 'name': names}) \
+        .groupby(['x', 'y', 'name'], sort=False, dropna=False).ngroup().to_numpy()
+    _, firsts = np.unique(groups, return_index=True)
+
+    return groups, firsts
+
+def fuzzy_rows(df):
+    """
+    The rows the fuzzy step looks up for data sorted by subject: the first
+    row of every name and the first unmatched row of every name. The rows
+    of several parts, sorted by subject again, give the rows of the whole.
+    """
+    unmatched = (df['certainty_ratio'] == 0.4).to_numpy()
+    names = df['locationName']
+    rows = df.index[~names.duplicated().to_numpy()] \
+        .union(df.index[unmatched][~names[unmatched].duplicated().to_numpy()])
+
+    return df.loc[rows, ['subject', 'locationName', 'thoroughfare', 'postCode',
+                         'certainty_ratio']]
+
+def _sorted_token_lengths(names):
+    """The lengths of the names with sorted tokens, sorted, and the order that sorts them."""
+    lengths = np.array([len(' '.join(sorted(name.split()))) for name in names])
+    order = np.argsort(lengths, kind='stable')
+
+    return lengths[order], order
 
 class ETLPipeline:
     """ETLPipeline is a class that provides methods for data cleansing and transformation."""
 
-    def __init__(self, input_csv, mapping_json):
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, input_csv, mapping_json, quarantine_txt='conf/to_remove.txt'):
         self.input_csv = input_csv
         self.mapping_json = mapping_json
+        self.quarantine_txt = quarantine_txt
         self.data = None
         self.mapping = None
+        self.fuzzy_pairs_applied = 0
+        self.profiler = None
+        self.categorical = True
+        # Opt-in geospatial deduplication: search radius in metres and the
+        # name similarity that confirms a match
+        self.geo_radius = None
+        self.geo_name_threshold = 80
+        # Optional FuzzyPairIndex with the name pairs scored in earlier runs
+        self.fuzzy_index = None
+        # Fuzzy pairs resolved on the whole data set, when it is deduplicated in parts
+        self.resolved_fuzzy_pairs = None
+        # Aggregation per column when grouping by subject, from AGGREGATIONS
+        self.aggregations = {}
+        self._duplicate_links = []
+
+    def profile(self, name):
+        """Measure a stage or step with the attached StageProfiler, if any."""
+        if self.profiler is None:
+            return contextlib.nullcontext()
+
+        return self.profiler.measure(name, lambda: 0 if self.data is None else len(self.data))
 
     def _load_mappings(self):
-        """Load mappings from a JSON file."""
-        with open(self.mapping_json, 'r', encoding='utf-8') as file:
-            self.mapping = json.load(file)
+        """Load and merge the mappings from one or more JSON files."""
+        self.mapping = UdbMapping.load(self.mapping_json,
+                                       lambda path: _read_mapping(path, _file_stamp(path)))
 
     def load_data(self) -> int:
-        """Load data from the CSV file."""
-        self.data = pd.read_csv(self.input_csv)
+        """Load data from the CSV or Parquet file."""
+        self.data = read_table(self.input_csv)
+        self.apply_schema()
         return len(self.data)
 
+    def apply_schema(self):
+        """Store the low-cardinality columns as categoricals, unless disabled."""
+        if self.categorical:
+            to_categorical(self.data)
+
     def filter_udb_location_type(self) -> int:
         """Filter out records based on UdbLocationID mapping."""
         # Ensure the mapping is loaded
         if self.mapping is None:
             self._load_mappings()
         # Filter logic
-        self.data = self.data[self.data['udbLocationType'] \
-            .isin(self.mapping.keys()) | self.data['udbLocationType'] \
-                .isna()]
+        self.data = self.data[self.mapping.known(self.data['udbLocationType'])]
 
         return len(self.data)
 
     def fill_empty_location_type(self):
         """"Update the locationType column based on the mapping."""
+        # Ensure the mapping is loaded, also when resuming from a checkpoint
+        if self.mapping is None:
+            self._load_mappings()
         # Apply the mapping to the locationType column
-        self.data['locationType'] = self.data['udbLocationType'] \
-            .map(self.mapping) \
-                .fillna(self.data['locationType'])
-
-    def group_by_id(self):
-        """Group the data by ID and aggregate the values dynamically."""
-        # Define specific aggregation rules for known columns
-        special_aggregations = { }
-
-        # Create a dynamic aggregation dictionary
-        aggregation_dict = {}
-        for col in self.data.columns:
-            if col in special_aggregations:
-                aggregation_dict[col] = special_aggregations[col]
-            elif col == 'subject':
-                continue
-            else:
-                aggregation_dict[col] = 'first'
-
-        # Group by 'subject' and apply the aggregation
-        self.data = self.data.groupby('subject').agg(aggregation_dict).reset_index()
+        location_types = self.data['locationType']
+        mapped = self.mapping.lookup(self.data['udbLocationType'])
+
+        self.data['locationType'] = like(mapped.fillna(location_types.astype(object)),
+                                         location_types)
+
+    def group_by_id(self, workers=None):
+        """Group the data by ID and aggregate the values dynamically, optionally in processes."""
+        for column, rule in self.aggregations.items():
+            if rule not in AGGREGATIONS:
+                raise ValueError(f"Unknown aggregation for {column}: {rule}")
+
+        # Subjects that occur once are their own group already
+        subjects = self.data['subject']
+        repeated = subjects.duplicated(keep=False).to_numpy()
+        single = self.data[~repeated & subjects.notna().to_numpy()]
+        repeated = self.data[repeated]
+
+        if workers and workers > 1 and len(repeated):
+            # Shards never split a subject, so they can be grouped on their own
+            shard = pd.util.hash_pandas_object(repeated['subject'], index=False).to_numpy() \
+                % (workers * 4)
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                grouped = pd.concat(executor.map(
+                    _aggregate, [part for _, part in repeated.groupby(shard)],
+                    itertools.repeat(self.aggregations)))
+        else:
+            grouped = _aggregate(repeated, self.aggregations)
+
+        # Sorted by subject, like a groupby over all rows
+        self.data = pd.concat([single, grouped]) \
+            .sort_values('subject', ignore_index=True)[['subject', *grouped.columns[1:]]]
+        # Aggregated columns can have new categories
+        self.apply_schema()
 
         return len(self.data)
 
+    def hash_rows(self):
+        """Add a content hash per row, so later runs can find changed subjects."""
+        columns = self.data.columns.drop('content_hash', errors='ignore')
+        self.data['content_hash'] = pd.util.hash_pandas_object(
+            self.data[columns], index=False).to_numpy().view(np.int64)
 
     def advanced_cleanup_strings(self):
         """Function to clean location names based on the specified rules."""
-        def advanced_clean_location_name(name):
-            name = str(name)
-
-            # Remove integers
-            name = re.sub(r'\d', '', name)
-
-            # Replace special quotes with standard quotes
-            name = name.replace('’', "'").replace('‘', "'").replace('“', '"').replace('”', '"')
-
-            # Replace 'T with 't and handle HTML escaped characters
-            name = name.replace("'T", "'t").replace("&#039;t", "'t").replace("&#;t", "'t")
-
-            # Remove ' / ? if they are the only characters in the string
-            if name in ["'", "/", "?"]:
-                name = ""
-
-            # Remove invalid characters (?, /, -) and leading/trailing whitespace
-            name = re.sub(r'[?/-]', ' ', name).strip()
-
-            # Replace multiple spaces with a single space
-            name = re.sub(r'\s+', ' ', name)
-
-            return name
-
-        def replace_decimal_zeros(value):
-            try:
-                # Check if the value is a string and ends with '.0'
-                if isinstance(value, str) and value.endswith('.0'):
-                    # Convert to integer and then to string to remove .0
-                    value = str(int(float(value)))
-                return value
-            except ValueError:
-                # If the conversion fails, return the original value
-                return value
-
-        # Function to remove single or double quotes from both ends of a
-        # string if the string starts and ends with either.
-        def strip_quotes(value):
-            try:
-                if isinstance(value, str):
-                    if (value.startswith("'") and value.endswith("'")) or \
-                        (value.startswith('"') and value.endswith('"')):
-                        value = value[1:-1]
-                return value
-            except ValueError:
-                return value
-
-        self.data['locationName'] = self.data['locationName'].apply(advanced_clean_location_name)
-        self.data['locationName'] = self.data['locationName'].apply(strip_quotes)
-        self.data['postCode'] = self.data['postCode'].apply(replace_decimal_zeros)
-
-    def deduplicate_data(self):
-        """Deduplicate the data based on specified rules."""
+        self.data['locationName'] = _map_unique(self.data['locationName'],
+                                                _clean_location_names)
+        self.data['postCode'] = _map_unique(self.data['postCode'], _replace_decimal_zeros)
+
+    def deduplicate_data(self, workers=None, phases=DEDUPLICATION_PHASES):
+        """
+        Deduplicate the data based on specified rules, optionally over worker processes.
+        :param workers: The worker processes for the exact-key steps.
+        :param phases: The phases to run, in order: 'exact' compares rows with
+            the same postCode, 'matching' links fuzzy names and nearby locations
+            and 'cluster' joins all links. Data deduplicated in parts runs them
+            in separate passes.
+        """
         df = self.data
-
-        # Step 1: Prepare data for deduplication
-        df = self._prepare_data_for_deduplication(df)
-
-        # Step 2: Initial deduplication
-        df = self._initial_deduplication(df)
-
-        # Step 3: Additional deduplication
-        df = self._additional_deduplication(df)
-
-        # Step 4: Fuzzy matching on location names
-        df = self._fuzzy_matching(df)
-
-        # Step 5: Final adjustments
-        df = self._final_adjustments(df)
+        self._duplicate_links = []
+        steps = []
+
+        if 'exact' in phases and workers and workers > 1:
+            # Steps 1 to 3 only compare rows with the same postCode
+            steps += [('sharded', lambda df: self._deduplicate_sharded(df, workers))]
+        elif 'exact' in phases:
+            steps += [
+                # Step 1: Prepare data for deduplication
+                ('prepare', self._prepare_data_for_deduplication),
+                # Step 2: Initial deduplication
+                ('initial', self._initial_deduplication),
+                # Step 3: Additional deduplication
+                ('additional', self._additional_deduplication)]
+
+        if 'matching' in phases:
+            # Step 4: Fuzzy matching on location names
+            steps += [('fuzzy_matching', self._fuzzy_matching)]
+
+            if self.geo_radius:
+                # Step 4b: Nearby locations with similar names
+                steps += [('geospatial', self._geospatial_deduplication)]
+
+            # Step 5: Final adjustments
+            steps += [('final_adjustments', self._final_adjustments)]
+
+        if 'cluster' in phases:
+            # Step 6: Cluster all duplicate links transitively
+            steps += [('cluster', self._cluster_duplicates)]
+
+        for name, step in steps:
+            # Rows are counted on self.data, which keeps the input until the end
+            with self.profile(name):
+                df = step(df)
 
         self.data = df
 
         # Return the number of rows per certainty_ratio value
         return df['certainty_ratio'].value_counts().sort_index()
 
+    @property
+    def duplicate_links(self):
+        """The (subject, duplicate_subject) links of the last deduplicate_data call."""
+        if not self._duplicate_links:
+            return pd.DataFrame(columns=['subject', 'duplicate_subject'], dtype=object)
+
+        return pd.concat([links.astype(object) for links in self._duplicate_links],
+                         ignore_index=True)
+
+    def resolve_fuzzy_pairs(self, rows):
+        """
+        Resolve the fuzzy name pairs of data deduplicated in parts once, so
+        every part applies the pairs the whole data set would.
+        :param rows: The fuzzy_rows of every part after the 'exact' phase.
+        :return: The number of fuzzy name pairs applied.
+        """
+        rows = fuzzy_rows(rows.sort_values('subject', ignore_index=True))
+        self.resolved_fuzzy_pairs = self._applied_fuzzy_pairs(
+            rows, rows['certainty_ratio'] == 0.4)
+        self.fuzzy_pairs_applied = len(self.resolved_fuzzy_pairs)
+
+        return self.fuzzy_pairs_applied
+
+    def _deduplicate_sharded(self, df, workers):
+        """Run the exact-key steps on postCode shards in a process pool."""
+        # Every exact-key subset contains postCode, so shards never split a group.
+        # Rows without a postCode get a fallback shard of their own.
+        shards = workers * 4
+        shard = pd.util.hash_pandas_object(df['postCode'], index=False).to_numpy() % shards
+        shard[df['postCode'].isna().to_numpy()] = shards
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(ETLPipeline._deduplicate_shard,
+                                        [part for _, part in df.groupby(shard)]))
+
+        for _, links in results:
+            self._duplicate_links.extend(links)
+
+        # Restore the original row order. Shards titled to other categories
+        # concatenate to strings, so make those categoricals again.
+        merged = pd.concat([part for part, _ in results]).reindex(df.index)
+        return merged.astype({column: 'category' for column in merged.columns
+                              if column in df and isinstance(df[column].dtype, pd.CategoricalDtype)
+                              and not isinstance(merged[column].dtype, pd.CategoricalDtype)})
+
+    @staticmethod
+    def _deduplicate_shard(df):
+        """Prepare and deduplicate one postCode shard on the exact-key subsets."""
+        # pylint: disable=protected-access
+        pipeline = ETLPipeline(None, None)
+
+        df = pipeline._prepare_data_for_deduplication(df)
+        df = pipeline._initial_deduplication(df)
+        df = pipeline._additional_deduplication(df)
+
+        return df, pipeline._duplicate_links
+
     def _prepare_data_for_deduplication(self, df):
         """Prepare data by converting subset fields to the correct casing."""
         subset_fields = ['locationName', 'locationType',
@@ -149,24 +436,30 @@ class ETLPipeline:
 
         for field in subset_fields:
             if field in ['locationName', 'thoroughfare', 'city']:
-                df[field] = df[field].str.title()
+                df[field] = like(df[field].str.title(), df[field])
 
         return df
 
+    def _subset_keys(self, df, subset):
+        """Compute one integer group key per row for a subset of fields."""
+        return df.groupby(subset, dropna=False, observed=True, sort=False).ngroup()
+
     def _initial_deduplication(self, df):
         """Perform initial deduplication based on subset fields."""
         subset_fields = ['locationName', 'locationType', 'thoroughfare',
                          'huisnummer', 'postCode', 'city']
 
-        duplicates = df.duplicated(subset=subset_fields, keep=False)
+        keys = self._subset_keys(df, subset_fields)
+        duplicates = keys.duplicated(keep=False)
 
-        df['certainty_ratio'] = duplicates.groupby(df[subset_fields]. \
-            apply(tuple, axis=1)).transform('mean')
+        df['certainty_ratio'] = duplicates.groupby(keys).transform('mean')
 
         df['is_duplicate'] = duplicates
 
         df['duplicate_subject'] = df.loc[duplicates, 'subject']. \
-            groupby(df[subset_fields].apply(tuple, axis=1)).transform('first')
+            groupby(keys[duplicates]).transform('first')
+
+        self._duplicate_links.append(df.loc[duplicates, ['subject', 'duplicate_subject']])
 
         return df
 
@@ -178,53 +471,183 @@ class ETLPipeline:
         ]
 
         for subset, certainty in additional_subsets:
-            condition = df['is_duplicate'] is False
-            new_duplicates = df.loc[condition].duplicated(subset=subset, keep=False)
-            df.loc[condition, 'certainty_ratio'] = df.loc[condition & new_duplicates, subset] \
-                .apply(tuple, axis=1).map(
-                df.loc[condition & new_duplicates, subset] \
-                    .apply(tuple, axis=1).value_counts(normalize=True)).fillna(0.0)
+            # Only rows that no earlier pass marked as duplicate
+            keys = self._subset_keys(df.loc[~df['is_duplicate']], subset)
+            new_duplicates = keys.duplicated(keep=False)
+            rows = new_duplicates.index[new_duplicates]
 
-            df.loc[condition & new_duplicates, 'certainty_ratio'] = certainty
-            df.loc[condition & new_duplicates, 'is_duplicate'] = True
+            df.loc[rows, 'certainty_ratio'] = certainty
+            df.loc[rows, 'is_duplicate'] = True
 
-            duplicate_subjects = df.loc[condition & new_duplicates, 'subject'].groupby(
-                df.loc[condition & new_duplicates, subset].apply(tuple, axis=1)).transform('first')
+            df.loc[rows, 'duplicate_subject'] = df.loc[rows, 'subject'] \
+                .groupby(keys[new_duplicates]).transform('first')
 
-            df.loc[condition & new_duplicates, 'duplicate_subject'] = duplicate_subjects
+            self._duplicate_links.append(df.loc[rows, ['subject', 'duplicate_subject']])
 
         return df
 
     def _fuzzy_matching(self, df):
         """Perform fuzzy matching on location names."""
         condition = df['certainty_ratio'] == 0.4
+        applied = self.resolved_fuzzy_pairs
+        if applied is None:
+            applied = self._applied_fuzzy_pairs(df, condition)
+            self.fuzzy_pairs_applied = len(applied)
+
+        self._apply_fuzzy_pairs(df, condition, applied)
+
+        return df
+
+    def _applied_fuzzy_pairs(self, df, condition):
+        """The fuzzy (match, subject) pairs whose first rows share thoroughfare and postCode."""
         unmatched_df = df[condition]
         all_names = unmatched_df['locationName'].dropna().unique().tolist()
-        matched_pairs = []
-
-        for name in all_names:
-            matches = process.extract(name,
-                                      all_names,
-                                      scorer=fuzz.token_sort_ratio,
-                                      limit=len(all_names))
-            for match in matches:
-                if match[1] >= 90 and name != match[0]:
-                    matched_pairs.append((name, match[0]))
-
-        for original, match in matched_pairs:
-            mask = (df['locationName'] == match) & condition
-            thoroughfare_match = df.loc[mask, 'thoroughfare'].values[0] == df. \
-                loc[df['locationName'] == original, 'thoroughfare'].values[0]
-            postcode_match = df.loc[mask, 'postCode'].values[0] == df. \
-                loc[df['locationName'] == original, 'postCode'].values[0]
-
-            if thoroughfare_match and postcode_match:
-                df.loc[mask, 'certainty_ratio'] = 0.5
-                first_subject = df.loc[df['locationName'] == original, 'subject'].iloc[0]
-                df.loc[mask, 'duplicate_subject'] = first_subject
+        matched_pairs = self._fuzzy_candidate_pairs(all_names)
+
+        if not matched_pairs:
+            return pd.DataFrame(columns=['match', 'subject'], dtype=object)
+
+        # Lookup tables with the first row per name, on both sides of a pair
+        originals = df.drop_duplicates('locationName') \
+            .set_index('locationName')[['thoroughfare', 'postCode', 'subject']]
+        matches = unmatched_df.drop_duplicates('locationName') \
+            .set_index('locationName')[['thoroughfare', 'postCode']]
+
+        pairs = pd.DataFrame(matched_pairs, columns=['original', 'match']) \
+            .join(originals, on='original') \
+            .join(matches, on='match', rsuffix='_match')
+        applied = pairs[pairs['thoroughfare'].eq(pairs['thoroughfare_match']) &
+                        pairs['postCode'].eq(pairs['postCode_match'])]
+
+        return applied[['match', 'subject']]
+
+    def _apply_fuzzy_pairs(self, df, condition, applied):
+        """Link the unmatched rows named after the match of an applied pair."""
+        if applied.empty:
+            return
+
+        # Every applied pair is a link, even when a later pair overwrites it
+        self._duplicate_links.append(
+            df.loc[condition, ['subject', 'locationName']]
+            .merge(applied.rename(columns={'subject': 'duplicate_subject'}),
+                   left_on='locationName', right_on='match')[['subject', 'duplicate_subject']])
+
+        # When several originals match the same name, the last one wins
+        first_subjects = applied.drop_duplicates('match', keep='last') \
+            .set_index('match')['subject']
+
+        mask = condition & df['locationName'].isin(first_subjects.index)
+        df.loc[mask, 'certainty_ratio'] = 0.5
+        df.loc[mask, 'duplicate_subject'] = df.loc[mask, 'locationName'].map(first_subjects)
+
+    def _fuzzy_candidate_pairs(self, names, threshold=90):
+        """Find all (name, match) pairs scoring at least threshold."""
+        if not names:
+            return []
+
+        if self.fuzzy_index is not None and self.fuzzy_index.threshold == threshold:
+            # Only names the index has not seen are scored
+            queries, choices, scores = self.fuzzy_index.scores(
+                names, lambda queries, choices:
+                self._fuzzy_block_scores(queries, threshold, choices))
+        else:
+            queries, choices, scores = (np.concatenate(part) for part in
+                                        zip(*self._fuzzy_block_scores(names, threshold)))
+
+        # Keep the order process.extract used to produce: per name in input
+        # order, best score first, ties broken by position in the name list.
+        keep = queries != choices
+        queries, choices, scores = queries[keep], choices[keep], scores[keep]
+        ordering = np.lexsort((choices, -scores, queries))
+
+        return [(names[i], names[j]) for i, j in zip(queries[ordering], choices[ordering])]
+
+    def _fuzzy_block_scores(self, names, threshold, choices=None, block_size=128):
+        """Score blocks of names against their length band of choices with process.cdist."""
+        # token_sort_ratio is an indel ratio on the sorted tokens, so two names
+        # can only reach the threshold if their lengths are close enough.
+        # Blocking on that length band is lossless, unlike blocking on postCode.
+        ratio = threshold / (200 - threshold)
+        choices = names if choices is None else choices
+        lengths, order = _sorted_token_lengths(names)
+        bands = (lengths, order) if choices is names else _sorted_token_lengths(choices)
+
+        for start in range(0, len(names), block_size):
+            block = order[start:start + block_size]
+            window = bands[1][
+                np.searchsorted(bands[0], lengths[start] * ratio - 1, 'left'):
+                np.searchsorted(bands[0], lengths[start + len(block) - 1] / ratio + 1, 'right')]
+
+            matrix = process.cdist([names[i] for i in block],
+                                   [choices[j] for j in window],
+                                   scorer=fuzz.token_sort_ratio,
+                                   dtype=np.float64,
+                                   score_cutoff=threshold,
+                                   workers=-1)
+            rows, cols = np.nonzero(matrix >= threshold)
+            yield block[rows], window[cols], matrix[rows, cols]
+
+    def _geospatial_deduplication(self, df):
+        """Link unmatched rows to locations within the radius that have a similar name."""
+        unmatched = ~df['is_duplicate'].to_numpy(dtype=bool)
+        subjects = df['subject'].to_numpy(dtype=object)
+        pairs = self._geospatial_pairs(df, unmatched, subjects)
+        if pairs.empty:
+            return df
+
+        self._duplicate_links.append(pd.DataFrame(
+            {'subject': subjects[pairs['row']], 'duplicate_subject': subjects[pairs['match']]}))
+
+        # Every unmatched row of a pair points at its best match: the most
+        # similar name, then the nearest location
+        both = pd.concat([pairs, pairs.rename(columns={'row': 'match', 'match': 'row'})])
+        best = both[unmatched[both['row']]] \
+            .sort_values(['score', 'distance'], ascending=[False, True], kind='stable') \
+            .drop_duplicates('row')
+        rows = df.index[best['row']]
+
+        # Stronger than an address match, weaker than a fuzzy name at the same address
+        df.loc[rows, 'certainty_ratio'] = 0.45
+        df.loc[rows, 'is_duplicate'] = True
+        df.loc[rows, 'duplicate_subject'] = subjects[best['match']]
 
         return df
 
+    def _geospatial_pairs(self, df, unmatched, subjects):
+        """
+        Find the row pairs within the radius with similar names and an unmatched row.
+        Rows with the same point and name are one candidate: the others of such a
+        group pair with its first row only, so a place that many sources put at
+        one point does not pair every row with every other.
+        """
+        x, y = points(df)
+        names = df['locationName'].astype(object).fillna('').to_numpy()
+        groups, firsts = _colocated(x, y, names)
+        # The first rows of the groups pair within the radius, if a group has an unmatched row
+        first, second = GridIndex(x[firsts], y[firsts], self.geo_radius).pairs()
+        keep = np.bincount(groups, weights=unmatched, minlength=len(firsts)) > 0
+        keep = keep[first] | keep[second]
+        first, second = firsts[first[keep]], firsts[second[keep]]
+
+        # Confirm the candidates with the same name scorer as the fuzzy step
+        scores = process.cpdist(names[first], names[second], scorer=fuzz.token_sort_ratio,
+                                dtype=np.float64, score_cutoff=self.geo_name_threshold,
+                                workers=-1)
+
+        # The other rows of a group have the name and point of its first row
+        others = np.flatnonzero((firsts[groups] != np.arange(len(df))) & ~np.isnan(x))
+        first, second = np.concatenate([first, firsts[groups[others]]]), \
+            np.concatenate([second, others])
+        scores = np.concatenate([scores, np.full(len(others), 100.0)])
+
+        confirmed = (scores >= self.geo_name_threshold) & (names[first] != '') & \
+            (unmatched[first] | unmatched[second]) & (subjects[first] != subjects[second])
+
+        return pd.DataFrame({'row': first[confirmed], 'match': second[confirmed],
+                             'score': scores[confirmed],
+                             'distance': np.hypot(x[first] - x[second],
+                                                  y[first] - y[second])[confirmed]})
+
     def _final_adjustments(self, df):
         """Make final adjustments to the dataframe."""
         df.loc[df['duplicate_subject'] == df['subject'], 'duplicate_subject'] = ""
@@ -240,22 +663,66 @@ class ETLPipeline:
 
         return df
 
+    def _cluster_duplicates(self, df):
+        """Merge all duplicate links into clusters with a canonical subject."""
+        codes, subjects = pd.factorize(df['subject'])
+        forest = DisjointSet(len(subjects))
+
+        if self._duplicate_links:
+            links = pd.concat(self._duplicate_links)
+            forest.union(subjects.get_indexer(links['subject']),
+                         subjects.get_indexer(links['duplicate_subject']))
+
+        roots = forest.find(codes)
+
+        # The smallest subject keeps the cluster ID stable across runs; compare
+        # sort ranks, since a string minimum per group is slow
+        order = subjects.argsort()
+        ranks = np.empty_like(order)
+        ranks[order] = np.arange(len(order))
+        smallest = pd.Series(ranks[codes]).groupby(roots).transform('min').to_numpy()
+        df['canonical_subject'] = subjects[order][smallest].to_numpy()
+        df['cluster_id'] = pd.util.hash_pandas_object(df['canonical_subject'], index=False)
+        df['cluster_certainty'] = df['certainty_ratio'].groupby(roots).transform('max')
+
+        return df
+
+    def remove(self, mode='substring'):
+        """Remove rows whose subject matches an entry in the quarantine file.
+
+        Mode 'exact' drops subjects equal to an entry, 'prefix' subjects that
+        start with one and 'substring' subjects that contain one.
+        """
+        # The non-empty lines of the file
+        to_remove = _read_quarantine(self.quarantine_txt, _file_stamp(self.quarantine_txt))
 
-    def remove(self):
-        """Remove rows that contain specific strings."""
-        # Open the file and read the lines
-        with open('conf/to_remove.txt', 'r', encoding='UTF-8') as file:
-            to_remove = file.readlines()
+        if not to_remove:
+            return len(self.data)
 
-        # Remove newline characters and create an array
-        to_remove = [line.strip() for line in to_remove]
+        subjects = self.data['subject']
+        if mode == 'exact':
+            quarantined = subjects.isin(to_remove)
+        elif mode == 'prefix':
+            quarantined = subjects.str.match(_trie_pattern(to_remove), na=False)
+        elif mode == 'substring':
+            quarantined = subjects.str.contains(_trie_pattern(to_remove), na=False)
+        else:
+            raise ValueError(f"Unknown quarantine mode: {mode}")
 
-        # Drop rows that contain any of the strings in the array
-        for string in to_remove:
-            self.data = self.data[~self.data['subject'].str.contains(string)]
+        # Drop all quarantined rows in a single pass
+        self.data = self.data[~quarantined]
 
         return len(self.data)
 
-    def save_data(self):
-        """Save the transformed data to the output CSV file."""
-        self.data.to_csv("cleansed.csv", encoding='utf-8', index=False)
+    def save_data(self, output="cleansed.csv"):
+        """
+        Save the transformed data to the output CSV or Parquet file, and the
+        content hashes to the side file next to it.
+        """
+        write_table(self.data.drop(columns='content_hash', errors='ignore'), output)
+
+        if 'content_hash' in self.data:
+            write_table(self.data[HASH_COLUMNS], hashes_path(output))
+        elif os.path.exists(hashes_path(output)):
+            # Hashes of an earlier output would not match this one
+            os.remove(hashes_path(output))
@@ -0,0 +1,127 @@
+"""
+Persistent index of the fuzzy name pairs scored in earlier runs.
+"""
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+class FuzzyPairIndex:
+    """
+    FuzzyPairIndex keeps every location name scored so far and all pairs
+    among them that reach the threshold, in two Arrow IPC files that are
+    memory-mapped on load. The names are ids by position.
+
+    The scorer is symmetric and only looks at the two names, so pairs of
+    known names can be taken from the index as they are. A run only scores
+    its new names against the known and new names, and its candidate pairs
+    are exactly those of scoring all names against each other.
+
+    Once more than max_names names are known, the index is rebuilt with
+    only the names of the current run and the pairs among them, so names
+    that left the input do not pile up.
+    """
+
+    def __init__(self, directory='.cache/fuzzy', threshold=90, max_names=1_000_000):
+        self.directory = directory
+        self.threshold = threshold
+        self.max_names = max_names
+        self.names = None
+        self.pairs = None
+
+    def _path(self, name):
+        return os.path.join(self.directory, f"{name}-{self.threshold}.arrow")
+
+    def load(self):
+        """Map the index files, or start empty when there are none."""
+        if self.names is not None:
+            return
+
+        if os.path.exists(self._path('names')) and os.path.exists(self._path('pairs')):
+            names, pairs = (pa.ipc.open_file(pa.memory_map(self._path(name))).read_all()
+                            for name in ('names', 'pairs'))
+            self.names = pd.Index(names.column('name').to_numpy(zero_copy_only=False),
+                                  dtype=object)
+            self.pairs = {column: pairs.column(column).to_numpy()
+                          for column in ('first', 'second', 'score')}
+        else:
+            self.names = pd.Index([], dtype=object)
+            self.pairs = {'first': np.empty(0, np.int32), 'second': np.empty(0, np.int32),
+                          'score': np.empty(0, np.float64)}
+
+    def scores(self, names, score):
+        """
+        The scores of all pairs of names reaching the threshold.
+        :param names: The distinct names of this run.
+        :param score: A function (queries, choices) that yields arrays of
+            query positions, choice positions and scores reaching the threshold.
+        :return: Arrays of query positions, choice positions and scores in
+            names, with both orders of every pair and no name paired with itself.
+        """
+        self.load()
+        new = pd.Index(names, dtype=object).difference(self.names, sort=False)
+
+        if len(new):
+            # Score the new names against every name the index knows afterwards
+            vocabulary = self.names.append(new)
+            first, second, scores = _concatenate(score(list(new), list(vocabulary)))
+            first = first + len(self.names)
+
+            # Store every pair once, with the smaller id first
+            keep = (first < second) | (second < len(self.names))
+            self._add(vocabulary, np.minimum(first, second)[keep],
+                      np.maximum(first, second)[keep], scores[keep])
+
+        if len(self.names) > self.max_names:
+            self._retain(names)
+
+        # Positions in names of the ids in the index, -1 for names of other runs
+        positions = np.full(len(self.names), -1)
+        positions[self.names.get_indexer(names)] = np.arange(len(names))
+        first, second = positions[self.pairs['first']], positions[self.pairs['second']]
+        keep = (first >= 0) & (second >= 0)
+        first, second, scores = first[keep], second[keep], self.pairs['score'][keep]
+
+        return (np.concatenate([first, second]), np.concatenate([second, first]),
+                np.concatenate([scores, scores]))
+
+    def _add(self, vocabulary, first, second, scores):
+        """Extend the index with new names and pairs and write it."""
+        self.names = vocabulary
+        self.pairs = {'first': np.concatenate([self.pairs['first'], first]).astype(np.int32),
+                      'second': np.concatenate([self.pairs['second'], second]).astype(np.int32),
+                      'score': np.concatenate([self.pairs['score'], scores])}
+        self._save()
+
+    def _retain(self, names):
+        """Rebuild the index with only these known names and the pairs among them."""
+        # Sorted ids keep the smaller id first in every pair
+        ids = np.unique(self.names.get_indexer(pd.Index(names, dtype=object)))
+        renumber = np.full(len(self.names), -1)
+        renumber[ids] = np.arange(len(ids))
+        first, second = renumber[self.pairs['first']], renumber[self.pairs['second']]
+        keep = (first >= 0) & (second >= 0)
+
+        self.names = self.names[ids]
+        self.pairs = {'first': first[keep].astype(np.int32),
+                      'second': second[keep].astype(np.int32),
+                      'score': self.pairs['score'][keep]}
+        self._save()
+
+    def _save(self):
+        """Write the names and pairs."""
+        os.makedirs(self.directory, exist_ok=True)
+        _write(self._path('names'), pa.table({'name': pa.array(self.names, pa.string())}))
+        _write(self._path('pairs'), pa.table(self.pairs))
+
+def _concatenate(blocks):
+    """Join the (queries, choices, scores) arrays of every scored block."""
+    parts = list(zip(*blocks)) or [[np.empty(0, np.int64)], [np.empty(0, np.int64)],
+                                   [np.empty(0, np.float64)]]
+    return tuple(np.concatenate(part) for part in parts)
+
+def _write(path, table):
+    """Write an uncompressed Arrow IPC file, which maps without copies, atomically."""
+    with pa.OSFile(f"{path}.tmp", 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(f"{path}.tmp", path)
@@ -0,0 +1,187 @@
+"""
+GML point parsing and a grid index for finding locations near each other.
+"""
+import numpy as np
+import pandas as pd
+
+SRS_NAME = r'srsName="([^"]*)"'
+# The first position of a gml:pos, gml:posList or gml:coordinates element
+POSITION = r'<gml:(?:pos|posList|coordinates)[^>]*>\s*([-+\d.eE]+)[\s,]+([-+\d.eE]+)'
+
+# Belgian Lambert 72 (EPSG:31370) on the International 1924 ellipsoid
+LAMBERT72 = {'a': 6378388.0, 'f': 1 / 297, 'lat1': 49.8333339, 'lat2': 51.16666723333333,
+             'lon0': 4.367486666666667, 'x0': 150000.013, 'y0': 5400088.438}
+# BD72 to WGS 84, position vector: translations in m, rotations in arc seconds, scale in ppm
+BD72_TO_WGS84 = (-106.8686, 52.2978, -103.7239, 0.3366, -0.457, 1.8422, -1.2747)
+WGS84 = {'a': 6378137.0, 'f': 1 / 298.257223563}
+
+def points(df):
+    """
+    The location of every row in Belgian Lambert 72 metres, from the gml
+    column or the point column when gml is empty.
+    :return: Arrays x and y, NaN where a row has no usable geometry.
+    """
+    if 'gml' not in df:
+        return np.full(len(df), np.nan), np.full(len(df), np.nan)
+
+    geometries = df['gml'].astype(object)
+    if 'point' in df:
+        geometries = geometries.where(geometries.notna() & geometries.ne(''),
+                                      df['point'].astype(object))
+
+    return parse_points(geometries)
+
+def parse_points(geometries):
+    """
+    Parse GML geometries into Lambert 72 coordinates, once per distinct value.
+    Points in WGS 84 or ETRS89 are projected, other reference systems are
+    left out. Other geometries than points are located by their first position.
+    :param geometries: A Series of GML strings.
+    :return: Arrays x and y, NaN where a geometry is missing or not understood.
+    """
+    codes, uniques = pd.factorize(geometries)
+    uniques = pd.Series(uniques, dtype=object)
+
+    srs = uniques.str.extract(SRS_NAME, expand=False).fillna('')
+    position = uniques.str.extract(POSITION)
+    first = pd.to_numeric(position[0], errors='coerce').to_numpy()
+    second = pd.to_numeric(position[1], errors='coerce').to_numpy()
+
+    # Without a reference system, coordinates of a few degrees are geographic
+    lambert = srs.str.contains('31370').to_numpy() | \
+        ((srs == '').to_numpy() & (np.abs(first) > 180))
+    geographic = srs.str.contains('4326|4258|CRS84').to_numpy() | \
+        ((srs == '').to_numpy() & (np.abs(first) <= 180))
+
+    x, y = np.full(len(uniques), np.nan), np.full(len(uniques), np.nan)
+    x[lambert], y[lambert] = first[lambert], second[lambert]
+
+    # Axis order differs between CRS84 and EPSG:4326 and between writers;
+    # in Belgium the latitude is always the larger number
+    lat = np.maximum(first[geographic], second[geographic])
+    lon = np.minimum(first[geographic], second[geographic])
+    x[geographic], y[geographic] = wgs84_to_lambert72(lon, lat)
+
+    # Missing geometries have code -1, which picks the NaN appended last
+    x, y = np.append(x, np.nan), np.append(y, np.nan)
+    return x[codes], y[codes]
+
+def wgs84_to_lambert72(lon, lat):
+    """Project WGS 84 degrees to Belgian Lambert 72 metres, to about a metre."""
+    lon, lat = _wgs84_to_bd72(np.radians(lon), np.radians(lat))
+
+    # Lambert conformal conic with two standard parallels
+    a, e = LAMBERT72['a'], _eccentricity(LAMBERT72)
+    lat1, lat2 = np.radians(LAMBERT72['lat1']), np.radians(LAMBERT72['lat2'])
+
+    def m(phi):
+        return np.cos(phi) / np.sqrt(1 - (e * np.sin(phi)) ** 2)
+
+    def t(phi):
+        return np.tan(np.pi / 4 - phi / 2) / \
+            ((1 - e * np.sin(phi)) / (1 + e * np.sin(phi))) ** (e / 2)
+
+    n = (np.log(m(lat1)) - np.log(m(lat2))) / (np.log(t(lat1)) - np.log(t(lat2)))
+    radius = a * m(lat1) / (n * t(lat1) ** n) * t(lat) ** n
+    theta = n * (lon - np.radians(LAMBERT72['lon0']))
+
+    # The origin latitude is the pole, where the radius is zero
+    return LAMBERT72['x0'] + radius * np.sin(theta), LAMBERT72['y0'] - radius * np.cos(theta)
+
+def _wgs84_to_bd72(lon, lat):
+    """Shift geodetic radians from the WGS 84 to the BD72 datum, through geocentric metres."""
+    tx, ty, tz, rx, ry, rz, scale = BD72_TO_WGS84
+    rx, ry, rz = np.radians(np.array([rx, ry, rz]) / 3600)
+    x, y, z = _geocentric(lon, lat, WGS84)
+    x, y, z = x - tx, y - ty, z - tz
+    # The inverse of the small rotation is its transpose
+    x, y, z = (np.array([x + rz * y - ry * z, -rz * x + y + rx * z, ry * x - rx * y + z])
+               / (1 + scale * 1e-6))
+
+    return _geodetic(x, y, z, LAMBERT72)
+
+def _eccentricity(ellipsoid):
+    return np.sqrt(ellipsoid['f'] * (2 - ellipsoid['f']))
+
+def _geocentric(lon, lat, ellipsoid):
+    """Geodetic radians on the ellipsoid surface to geocentric metres."""
+    a, e = ellipsoid['a'], _eccentricity(ellipsoid)
+    normal = a / np.sqrt(1 - (e * np.sin(lat)) ** 2)
+
+    return (normal * np.cos(lat) * np.cos(lon), normal * np.cos(lat) * np.sin(lon),
+            normal * (1 - e ** 2) * np.sin(lat))
+
+def _geodetic(x, y, z, ellipsoid):
+    """Geocentric metres to geodetic radians, with Bowring's formula."""
+    a, e = ellipsoid['a'], _eccentricity(ellipsoid)
+    b = a * (1 - ellipsoid['f'])
+    p = np.hypot(x, y)
+    theta = np.arctan2(z * a, p * b)
+    lat = np.arctan2(z + (e * a / b) ** 2 * b * np.sin(theta) ** 3,
+                     p - e ** 2 * a * np.cos(theta) ** 3)
+
+    return np.arctan2(y, x), lat
+
+class GridIndex:
+    """
+    GridIndex hashes points into square cells as wide as the search radius,
+    so every point within the radius of a query lies in the query's cell or
+    one of its eight neighbours. Building the index sorts the cell keys once;
+    a query looks up nine cell ranges per point with a binary search, so
+    the cost is O(n log n) plus the number of candidates in those cells.
+    """
+
+    def __init__(self, x, y, radius):
+        self.x, self.y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        self.radius = float(radius)
+
+        valid, keys = self._keys(self.x, self.y)
+        indexed = np.flatnonzero(valid)
+        self.order = indexed[np.argsort(keys[indexed], kind='stable')]
+        self.sorted_keys = keys[self.order]
+
+    def _keys(self, x, y):
+        """Whether points have coordinates, and one integer per cell."""
+        valid = ~(np.isnan(x) | np.isnan(y))
+        column = np.floor(np.where(valid, x, 0) / self.radius).astype(np.int64)
+        row = np.floor(np.where(valid, y, 0) / self.radius).astype(np.int64)
+        # Offsetting the row keeps keys of negative coordinates apart
+        return valid, (column << 32) + row + (1 << 31)
+
+    def query(self, x, y):
+        """
+        Find the indexed points within the radius of query points.
+        :return: Arrays of query positions and indexed point positions, one
+            element per pair within the radius.
+        """
+        x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        valid, keys = self._keys(x, y)
+        # Sorted lookups walk the index in order, which is much faster than
+        # random ones; shifting a cell by whole cells keeps the order
+        ordered = np.flatnonzero(valid)
+        ordered = ordered[np.argsort(keys[ordered], kind='stable')]
+        keys = keys[ordered]
+        queries, found = [], []
+
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                neighbours = keys + (dx << 32) + dy
+                start = np.searchsorted(self.sorted_keys, neighbours, 'left')
+                counts = np.searchsorted(self.sorted_keys, neighbours, 'right') - start
+
+                # Expand every query to the positions of its cell range
+                queries.append(np.repeat(ordered, counts))
+                found.append(self.order[np.repeat(start, counts) + np.arange(counts.sum())
+                                        - np.repeat(np.cumsum(counts) - counts, counts)])
+
+        queries, found = np.concatenate(queries), np.concatenate(found)
+        near = np.hypot(x[queries] - self.x[found], y[queries] - self.y[found]) <= self.radius
+
+        return queries[near], found[near]
+
+    def pairs(self):
+        """The pairs (i, j) with i < j of indexed points within the radius of each other."""
+        first, second = self.query(self.x, self.y)
+        keep = first < second
+
+        return first[keep], second[keep]
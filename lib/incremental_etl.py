@@ -0,0 +1,130 @@
+"""
+Incremental ETL runs against the previous cleansed output.
+"""
+import os
+import numpy as np
+import pandas as pd
+from lib.etl_pipeline import ETLPipeline, hashes_path
+from lib.geometry import GridIndex, points
+from lib.table_io import read_table
+
+# Columns written by ETLPipeline.deduplicate_data
+DEDUPLICATION_COLUMNS = ['certainty_ratio', 'is_duplicate', 'duplicate_subject',
+                         'canonical_subject', 'cluster_id', 'cluster_certainty']
+
+class IncrementalETL:
+    """
+    IncrementalETL compares the content hash of every grouped subject with
+    the previous cleansed output. Only new and changed subjects are cleaned
+    again, and deduplication only runs again for the postCode blocks that
+    share a postCode, name key or cluster with a new, changed or removed
+    subject, or lie within the geospatial radius of one. All other rows
+    keep their certainty and duplicate links.
+
+    The content hashes are read from the side file next to the previous
+    output. Fuzzy name pairs are resolved within the recomputed blocks, so
+    after a change links to names outside them can differ from a full run;
+    an unchanged input gives the output of a full run.
+    """
+
+    # pylint: disable=too-few-public-methods
+    def __init__(self, pipeline: ETLPipeline):
+        self.pipeline = pipeline
+
+    def run(self, previous_path, quarantine_mode='substring', workers=None):
+        """
+        Update the pipeline data, which must be grouped and hashed already.
+        :param previous_path: The previous cleansed CSV or Parquet file.
+        :param quarantine_mode: The mode passed to ETLPipeline.remove.
+        :param workers: The worker processes passed to deduplicate_data.
+        :return: A dict with the number of new, changed, removed, unchanged
+            and recomputed subjects.
+        """
+        grouped = self.pipeline.data
+        previous = _read_previous(previous_path)
+
+        known = grouped['subject'].isin(previous['subject'])
+        changed = known & grouped['content_hash'].ne(
+            grouped['subject'].map(previous.set_index('subject')['content_hash']))
+        removed = ~previous['subject'].isin(grouped['subject'])
+        stale = previous['subject'].isin(grouped.loc[changed, 'subject']) | removed
+
+        # Keep the previous deduplication results apart, by subject
+        deduplicated = previous.set_index('subject').reindex(columns=DEDUPLICATION_COLUMNS)
+        previous = previous.drop(columns=DEDUPLICATION_COLUMNS, errors='ignore')
+
+        # Clean only new and changed subjects, keep the rest as they were
+        self.pipeline.data = grouped[~known | changed]
+        with self.pipeline.profile('cleanup'):
+            self.pipeline.advanced_cleanup_strings()
+        with self.pipeline.profile('fill'):
+            self.pipeline.fill_empty_location_type()
+        self.pipeline.data = pd.concat([self.pipeline.data, previous[~stale]]) \
+            .sort_values('subject', ignore_index=True)
+        # Concatenated categoricals with other categories fall back to strings
+        self.pipeline.apply_schema()
+
+        # The quarantine list may have changed since the previous run
+        with self.pipeline.profile('remove'):
+            self.pipeline.remove(quarantine_mode)
+        data = self.pipeline.data
+
+        # The old and new values of every new, changed and removed subject
+        touched = pd.concat([data[data['subject'].isin(grouped.loc[~known | changed, 'subject'])],
+                             previous[stale]])
+        affected = _affected_blocks(data, touched, deduplicated['canonical_subject'],
+                                    self.pipeline.geo_radius)
+
+        # Deduplicate the affected blocks again, in the subject order of a full run
+        self.pipeline.data = data[affected].reset_index(drop=True)
+        with self.pipeline.profile('dedup'):
+            self.pipeline.deduplicate_data(workers)
+
+        # The other rows keep their certainty and duplicate links; skip
+        # empty parts, so the dedup column dtypes survive the concat
+        parts = [part for part in (self.pipeline.data,
+                                   data[~affected].join(deduplicated, on='subject'))
+                 if len(part)]
+        self.pipeline.data = pd.concat(parts).sort_values('subject', ignore_index=True)
+        self.pipeline.apply_schema()
+
+        return {'new': int((~known).sum()), 'changed': int(changed.sum()),
+                'removed': int(removed.sum()), 'unchanged': int((known & ~changed).sum()),
+                'recomputed': int(affected.sum())}
+
+def _read_previous(path):
+    """The previous output with the content hashes of the side file next to it."""
+    previous = read_table(path)
+    if os.path.exists(hashes_path(path)):
+        hashes = read_table(hashes_path(path)).set_index('subject')['content_hash']
+        previous['content_hash'] = previous['subject'].map(hashes)
+    elif 'content_hash' not in previous:
+        # Output of a run without hashes: every known subject counts as changed
+        previous['content_hash'] = pd.NA
+
+    return previous
+
+def _affected_blocks(data, touched, clusters, radius=None):
+    """
+    Mask of the rows to deduplicate again: rows sharing a postCode, name key
+    or previous cluster with a touched row, widened to whole postCode blocks,
+    since every exact-key subset of the deduplication contains postCode.
+    With a geospatial radius, the blocks of rows near a touched row or the
+    blocks above are added too, so matches across postCodes are redone.
+    """
+    touched_clusters = touched['subject'].map(clusters).dropna()
+
+    seeds = data['postCode'].isin(touched['postCode']) | \
+        data['locationName'].str.title().isin(touched['locationName'].str.title()) | \
+        data['subject'].map(clusters).isin(touched_clusters)
+    affected = data['postCode'].isin(data.loc[seeds, 'postCode'])
+
+    if radius:
+        x, y = points(data)
+        index = GridIndex(x, y, radius)
+        _, near = index.query(*points(touched))
+        _, near_affected = index.query(x[affected.to_numpy()], y[affected.to_numpy()])
+        seeds.iloc[np.concatenate([near, near_affected])] = True
+        affected = data['postCode'].isin(data.loc[seeds, 'postCode'])
+
+    return affected
@@ -1,22 +1,63 @@
 """This module provides a class to interact with the Linked Data API of UiTwisselingsplatform."""
+import re
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import httpx
 from authlib.integrations.httpx_client import OAuth2Client
-from pandas import DataFrame
+from pandas import concat
 from conf import config
+from lib.sparql_results import MEDIA_TYPES, parse_results
+
+# The projection of the outermost SELECT, and the alias of one expression in it
+PROJECTION = re.compile(r'\bSELECT\s+(?:DISTINCT\s+|REDUCED\s+)?(.*?)\bWHERE\b',
+                        re.IGNORECASE | re.DOTALL)
+ALIAS = re.compile(r'\((?:[^()]|\([^()]*\))*?\bAS\s+([?$]\w+)\s*\)', re.IGNORECASE)
+VARIABLE = re.compile(r'[?$](\w+)')
+
+def projected_variables(query):
+    """
+    The variables a SELECT query returns, in order. For SELECT * these are
+    all variables of the query; ordering by one that is not bound is a no-op.
+    """
+    match = PROJECTION.search(query)
+    if match is None:
+        return []
+
+    projection = match.group(1).strip()
+    if projection == '*':
+        return list(dict.fromkeys(VARIABLE.findall(query)))
+
+    return list(dict.fromkeys(VARIABLE.findall(ALIAS.sub(r' \1 ', projection))))
+
+# Responses worth another attempt: rate limiting and server side failures
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
 
 class LinkedDataAPI:
     """
     LinkedDataAPI is a class that provides methods to interact 
     with the Linked Data API of UiTwisselingsplatform.
     """
-    def __init__(self):
-        self.client = OAuth2Client(
-            client_id=config.client_id,
-            client_secret=config.client_secret,
-            scope='profile email openid')
+    def __init__(self, client=None):
+        # Several instances can share one authenticated client and its pool
+        if client is None:
+            client = OAuth2Client(
+                client_id=config.client_id,
+                client_secret=config.client_secret,
+                scope='profile email openid',
+                token_endpoint=config.token_url,
+                grant_type='client_credentials')
+
+            # The client fetches a new token by itself once this one expires
+            client.fetch_token(config.token_url)
 
-        self.client.fetch_token(config.token_url)
+        self.client = client
         self.data_endpoint = None
         self.query = None
+        self.result_format = 'json'
+        self.cache = None
+        self.retries = 3
+        self.backoff = 1.0
 
     def set_data_endpoint(self, data_endpoint):
         """Set the data endpoint of the Linked Data API."""
@@ -26,16 +67,164 @@ class LinkedDataAPI:
         """Set the query to be sent to the Linked Data API."""
         self.query = query
 
-    def fetch_data(self):
-        """Fetch data from the Linked Data API."""
-        response = self.client.post(self.data_endpoint,
-                                    data={'query': self.query},
-                                    timeout=None)
+    def set_result_format(self, result_format):
+        """Set the result format to request: json, csv or tsv."""
+        self.result_format = result_format
+
+    def set_cache(self, cache):
+        """Set the ResponseCache to serve and store results, or None to disable it."""
+        self.cache = cache
+
+    def fetch_data(self, page_size=None, workers=4):
+        """Fetch data from the Linked Data API, in pages if page_size is set."""
+        if self.cache is None:
+            df, _ = self._download(page_size, workers)
+            return df
+
+        key = self.cache.key(self.data_endpoint, self.query)
+        cached = self.cache.get(key)
+        validators = {}
+
+        if cached is not None:
+            df, meta = cached
+            if self.cache.is_fresh(meta):
+                return df
+
+            # Paged downloads are not conditional and bring no validators
+            if meta.get('etag') and not page_size:
+                validators['If-None-Match'] = meta['etag']
+            if meta.get('last_modified') and not page_size:
+                validators['If-Modified-Since'] = meta['last_modified']
+
+            # Without validators a cheap row count tells whether the data changed
+            if not validators and self.count() == meta['rows']:
+                self.cache.touch(key)
+                return df
+
+        df, headers = self._download(page_size, workers, validators)
+
+        if df is None and headers is not None:
+            # 304 Not Modified
+            self.cache.touch(key)
+            return cached[0]
+
+        if df is not None:
+            self.cache.put(key, df, {'endpoint': self.data_endpoint,
+                                     'etag': headers.get('ETag'),
+                                     'last_modified': headers.get('Last-Modified')})
+        return df
+
+    def count(self):
+        """Count the rows of the query result with a cheap probe query."""
+        df = self._query(f"""
+            SELECT (COUNT(*) AS ?count) WHERE {{
+                {self.query}
+            }}
+        """)
+        return int(df['count'].iloc[0])
+
+    def _download(self, page_size, workers, validators=None):
+        """
+        Download the query result, in pages if page_size is set. Returns the
+        DataFrame and the response headers, (None, headers) for 304 Not
+        Modified and (None, None) on errors. Validators only apply unpaged.
+        """
+        try:
+            if page_size:
+                pages = list(self.fetch_pages(page_size, workers))
+                return (concat(pages, ignore_index=True), {}) if pages else (None, None)
+
+            return self._send(self.query, validators)
+        except httpx.HTTPStatusError as error:
+            print(error)
+            return None, None
+
+    def fetch_pages(self, page_size, workers=4):
+        """
+        Fetch the query result in LIMIT/OFFSET windows ordered by every
+        returned variable, so rows sharing a subject have a fixed order too.
+        Up to workers pages are requested concurrently; pages are yielded
+        in order as soon as they arrive, until a page comes back short.
+        """
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque(executor.submit(self._fetch_page, offset, page_size)
+                            for offset in range(0, workers * page_size, page_size))
+            next_offset = workers * page_size
+
+            while pending:
+                page = pending.popleft().result()
+
+                if len(page) < page_size:
+                    # Last page: pages past it are empty, skip what has not started
+                    for future in pending:
+                        future.cancel()
+                    if len(page):
+                        yield page
+                    return
+
+                pending.append(executor.submit(self._fetch_page, next_offset, page_size))
+                next_offset += page_size
+                yield page
+
+    def _page_order(self):
+        """
+        A total order of the result rows: ?subject first, then the other
+        variables. Ties between pages would let LIMIT/OFFSET windows overlap
+        or skip rows, e.g. for the several rows a UNION gives one subject.
+        """
+        variables = projected_variables(self.query)
+        variables = ['subject'] + [name for name in variables if name != 'subject']
+
+        return ' '.join(f"?{name}" for name in variables)
+
+    def _fetch_page(self, offset, page_size):
+        """Fetch one window of the query result."""
+        query = f"""
+            SELECT * WHERE {{
+                {self.query}
+            }}
+            ORDER BY {self._page_order()}
+            LIMIT {page_size}
+            OFFSET {offset}
+        """
+        return self._query(query)
+
+    def _query(self, query):
+        """Send a query and return the parsed result."""
+        df, _ = self._send(query)
+        return df
+
+    def _send(self, query, headers=None):
+        """
+        Send a query and parse the result while it streams in, retrying
+        transport errors and 429/5xx responses with exponential backoff.
+        Returns the result and the response headers; the result is None
+        when a conditional request comes back 304 Not Modified.
+        """
+        headers = {'Accept': MEDIA_TYPES[self.result_format], **(headers or {})}
+
+        for attempt in range(self.retries + 1):
+            try:
+                with self.client.stream('POST', self.data_endpoint,
+                                        data={'query': query},
+                                        headers=headers,
+                                        timeout=None) as response:
+                    if response.status_code == 200:
+                        return (parse_results(response.iter_bytes(), self.result_format),
+                                response.headers)
+
+                    if response.status_code == 304:
+                        return None, response.headers
+
+                    if response.status_code not in RETRY_STATUS_CODES or attempt == self.retries:
+                        response.read()
+                        raise httpx.HTTPStatusError(
+                            f'Error: {response.status_code} - {response.text}',
+                            request=response.request, response=response)
+            except httpx.TransportError:
+                if attempt == self.retries:
+                    raise
 
-        if response.status_code == 200:
-            data = response.json()
-            df = DataFrame(data['results']['bindings'])
-            return df.map(lambda x: x['value'])
+            time.sleep(self.backoff * 2 ** attempt)
 
-        print(f'Error: {response.status_code} - {response.text}')
-        return None
+        return None, None
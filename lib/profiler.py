@@ -0,0 +1,110 @@
+"""
+Per-stage profiling of the ETL pipeline.
+"""
+import cProfile
+import json
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+class StageProfiler:
+    """
+    StageProfiler records wall time, CPU time, peak RSS and rows in and out
+    for every measured stage. Stages measured inside another stage are
+    reported as its steps. Optionally it also traces the peak Python memory
+    per stage with tracemalloc, which slows allocation-heavy stages down a
+    lot, and profiles the whole run with cProfile.
+    """
+
+    def __init__(self, trace_memory=False, cprofile=False):
+        self.trace_memory = trace_memory
+        self.cprofile = cProfile.Profile() if cprofile else None
+        self.stages = []
+        self.started = None
+        self._stack = []
+
+    def start(self):
+        """Start tracing memory and profiling calls."""
+        self.started = datetime.now(timezone.utc).isoformat()
+        if self.trace_memory:
+            tracemalloc.start()
+        if self.cprofile:
+            self.cprofile.enable()
+
+    def stop(self):
+        """Stop tracing memory and profiling calls."""
+        if self.cprofile:
+            self.cprofile.disable()
+        if self.trace_memory:
+            tracemalloc.stop()
+
+    @contextmanager
+    def measure(self, name, rows=None):
+        """
+        Measure the stage run inside the with block.
+        :param name: The stage or step name.
+        :param rows: A callable returning the current row count.
+        """
+        if self._stack:
+            # Keep the peak of the enclosing stage before resetting it
+            self._stack[-1]['peak_traced_bytes'] = max(
+                self._stack[-1]['peak_traced_bytes'], self._traced_peak())
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+
+        record = {'name': name, 'rows_in': rows() if rows else None, 'peak_traced_bytes': 0,
+                  'steps': []}
+        (self._stack[-1]['steps'] if self._stack else self.stages).append(record)
+        self._stack.append(record)
+
+        times = os.times()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            after = os.times()
+            record['wall_seconds'] = time.perf_counter() - wall
+            record['cpu_seconds'] = time.process_time() - cpu
+            # Worker processes are counted once they have been waited for
+            record['child_cpu_seconds'] = after.children_user + after.children_system \
+                - times.children_user - times.children_system
+            record['peak_traced_bytes'] = max(record['peak_traced_bytes'], self._traced_peak())
+            record['max_rss_bytes'] = _max_rss()
+            record['rows_out'] = rows() if rows else None
+
+            self._stack.pop()
+            if self._stack:
+                self._stack[-1]['peak_traced_bytes'] = max(
+                    self._stack[-1]['peak_traced_bytes'], record['peak_traced_bytes'])
+
+    def _traced_peak(self):
+        return tracemalloc.get_traced_memory()[1] if self.trace_memory else 0
+
+    def report(self):
+        """The measurements as a JSON serializable dict."""
+        return {'started': self.started, 'stages': self.stages}
+
+    def write(self, path):
+        """Write the JSON report."""
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(self.report(), file, indent=2)
+
+    def dump_stats(self, path):
+        """Write the cProfile statistics, to be read with pstats."""
+        self.cprofile.dump_stats(path)
+
+def _max_rss():
+    """Peak resident set size of the process in bytes, when known."""
+    if resource is None:
+        return None
+
+    # Linux reports kilobytes, macOS bytes
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if os.uname().sysname == 'Darwin' else rss * 1024
@@ -0,0 +1,93 @@
+"""
+On-disk cache for query results of the Linked Data API.
+"""
+import contextlib
+import hashlib
+import json
+import os
+import time
+from lib.table_io import read_table, write_table
+
+class ResponseCache:
+    """
+    ResponseCache stores query results as Parquet files, keyed by a
+    hash of the endpoint and the query, together with the metadata needed
+    to revalidate them: fetch time, row count, ETag and Last-Modified.
+    """
+
+    def __init__(self, cache_dir='.cache/sparql', ttl=3600, max_bytes=1 << 30):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(endpoint, query):
+        """Content address for an endpoint and query pair."""
+        return hashlib.sha256(f"{endpoint}\n{query}".encode('utf-8')).hexdigest()
+
+    def _paths(self, key):
+        return (os.path.join(self.cache_dir, f"{key}.parquet"),
+                os.path.join(self.cache_dir, f"{key}.json"))
+
+    def get(self, key):
+        """
+        Look up a cached result.
+        :param key: The cache key.
+        :return: A (DataFrame, metadata) tuple, or None when not cached.
+        """
+        data_path, meta_path = self._paths(key)
+        if not (os.path.exists(data_path) and os.path.exists(meta_path)):
+            return None
+
+        with open(meta_path, 'r', encoding='utf-8') as file:
+            meta = json.load(file)
+
+        # Mark the entry as recently used for eviction
+        os.utime(data_path)
+
+        # Parquet keeps missing values apart from empty strings, like a fresh fetch
+        return read_table(data_path), meta
+
+    def is_fresh(self, meta):
+        """Whether an entry is younger than the TTL and needs no revalidation."""
+        return time.time() - meta['fetched'] < self.ttl
+
+    def put(self, key, df, meta):
+        """Store a result with its metadata and evict entries over the size limit."""
+        data_path, meta_path = self._paths(key)
+
+        write_table(df, data_path)
+        with open(meta_path, 'w', encoding='utf-8') as file:
+            json.dump({**meta, 'fetched': time.time(), 'rows': len(df)}, file)
+
+        self._evict()
+
+    def touch(self, key):
+        """Restart the TTL of an entry that was revalidated."""
+        _, meta_path = self._paths(key)
+
+        with open(meta_path, 'r', encoding='utf-8') as file:
+            meta = json.load(file)
+        with open(meta_path, 'w', encoding='utf-8') as file:
+            json.dump({**meta, 'fetched': time.time()}, file)
+
+    def _evict(self):
+        """Remove the least recently used entries until the cache fits max_bytes."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.parquet'):
+                # Another fetch may evict or replace the entry meanwhile
+                with contextlib.suppress(FileNotFoundError):
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                    entries.append((stat.st_mtime, stat.st_size, name[:-len('.parquet')]))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            for path in self._paths(key):
+                # Another fetch may have evicted it already
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+            total -= size
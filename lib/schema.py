@@ -0,0 +1,58 @@
+"""
+In-memory schema of the location columns: categoricals for low-cardinality text.
+"""
+import pandas as pd
+
+# Columns with a handful to a few thousand distinct values over millions of rows
+CATEGORY_COLUMNS = ['locationType', 'udbLocationType', 'bron', 'city', 'postCode']
+
+def to_categorical(df, columns=None):
+    """
+    Store the low-cardinality text columns of a DataFrame as categoricals.
+    :param df: The DataFrame, changed in place.
+    :param columns: The columns to convert, CATEGORY_COLUMNS by default.
+    :return: The DataFrame.
+    """
+    for column in columns or CATEGORY_COLUMNS:
+        if column in df and not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype('category')
+
+    return df
+
+def like(values, column):
+    """Turn values computed from a column back into the column's dtype, or a categorical."""
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return values.astype('category')
+
+    return values.astype(column.dtype)
+
+def memory_report(df):
+    """
+    Compare the memory of every text column as it is stored now, as Python
+    objects, as Arrow-backed strings and as a categorical.
+    :return: A DataFrame with the bytes per representation, one row per
+        column and a total row.
+    """
+    rows = {}
+    for column in df.columns:
+        values = df[column]
+        if not (pd.api.types.is_object_dtype(values) or pd.api.types.is_string_dtype(values)
+                or isinstance(values.dtype, pd.CategoricalDtype)):
+            continue
+
+        rows[column] = {
+            'dtype': 'category' if isinstance(values.dtype, pd.CategoricalDtype)
+                     else str(values.dtype),
+            'distinct': values.nunique(),
+            'current': values.memory_usage(deep=True, index=False),
+            'object': values.astype(object).memory_usage(deep=True, index=False),
+            'arrow_string': values.astype(pd.StringDtype('pyarrow'))
+                            .memory_usage(deep=True, index=False),
+            'categorical': values.astype('category').memory_usage(deep=True, index=False),
+        }
+
+    report = pd.DataFrame.from_dict(rows, orient='index')
+    totals = report.drop(columns=['dtype', 'distinct']).sum()
+
+    report = pd.concat([report, totals.to_frame('total').T])
+    return report.astype({'distinct': 'Int64'})
@@ -0,0 +1,156 @@
+"""
+Streaming parsers for SPARQL query results in JSON, CSV and TSV format.
+"""
+import codecs
+import csv
+import io
+import json
+import re
+import pandas as pd
+
+# Accept headers for the supported result formats
+MEDIA_TYPES = {
+    'json': 'application/sparql-results+json',
+    'csv': 'text/csv',
+    'tsv': 'text/tab-separated-values',
+}
+
+BINDINGS = re.compile(r'"bindings"\s*:\s*\[')
+VARS = re.compile(r'"vars"\s*:\s*(\[[^\]]*\])')
+LITERAL = re.compile(r'^"(.*)"(?:@[A-Za-z0-9-]+|\^\^<[^>]*>)?$', re.DOTALL)
+ESCAPE = re.compile(r'\\(.)')
+ESCAPES = {'t': '\t', 'n': '\n', 'r': '\r', 'b': '\b', 'f': '\f'}
+
+class _ChunkReader(io.RawIOBase):
+    """File-like wrapper around an iterator of byte chunks."""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.pending = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.pending:
+            self.pending = next(self.chunks, None)
+            if self.pending is None:
+                self.pending = b''
+                return 0
+
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+def parse_results(chunks, result_format='json'):
+    """
+    Parse a SPARQL result from an iterator of byte chunks.
+    :param chunks: The response body, e.g. response.iter_bytes().
+    :param result_format: One of 'json', 'csv' or 'tsv'.
+    :return: A DataFrame with one text column per variable, NaN where a
+        variable is unbound.
+    """
+    if result_format == 'json':
+        return parse_json(chunks)
+    if result_format == 'csv':
+        return parse_csv(chunks)
+    if result_format == 'tsv':
+        return parse_tsv(chunks)
+
+    raise ValueError(f"Unknown result format: {result_format}")
+
+def parse_json(chunks):
+    """
+    Parse application/sparql-results+json one binding at a time, appending
+    the values straight to column buffers instead of keeping the whole
+    decoded document around.
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buffer = ''
+    columns = None
+
+    def read_more():
+        nonlocal buffer
+        chunk = next(chunks, None)
+        if chunk is None:
+            raise ValueError("Incomplete SPARQL JSON result")
+        buffer += text.decode(chunk)
+
+    # Everything before the bindings array holds the head with the variables
+    while (start := BINDINGS.search(buffer)) is None:
+        read_more()
+
+    head = VARS.search(buffer, 0, start.start())
+    if head:
+        columns = {var: [] for var in json.loads(head.group(1))}
+    else:
+        columns = {}
+
+    rows = 0
+    position = start.end()
+    while True:
+        # Skip separators between the binding objects
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+        if position == len(buffer):
+            buffer, position = '', 0
+            read_more()
+            continue
+        if buffer[position] == ']':
+            break
+
+        try:
+            binding, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            # The binding continues in the next chunk
+            buffer, position = buffer[position:], 0
+            read_more()
+            continue
+
+        for var in binding.keys() - columns.keys():
+            columns[var] = [None] * rows
+        for var, values in columns.items():
+            term = binding.get(var)
+            values.append(term['value'] if term else None)
+
+        rows += 1
+        position = end
+
+    return _as_text(pd.DataFrame(columns))
+
+def parse_csv(chunks):
+    """
+    Bulk load text/csv results with the C CSV reader. CSV writes unbound
+    variables and empty literals alike, so both come back missing.
+    """
+    return _as_text(pd.read_csv(io.BufferedReader(_ChunkReader(chunks)),
+                                dtype=str, keep_default_na=False, na_values=['']))
+
+def parse_tsv(chunks):
+    """Bulk load text/tab-separated-values results and unwrap the RDF terms."""
+    # Unbound variables are empty fields; an empty literal is written ""
+    df = pd.read_csv(io.BufferedReader(_ChunkReader(chunks)), sep='\t',
+                     quoting=csv.QUOTE_NONE, dtype=str,
+                     keep_default_na=False, na_values=[''])
+    df.columns = [column.lstrip('?') for column in df.columns]
+
+    for column in df.columns:
+        values = df[column]
+
+        # IRIs are written as <iri>, literals as "text", "text"@lang or "text"^^<type>
+        iri = values.str.startswith('<') & values.str.endswith('>')
+        literal = values.str.extract(LITERAL, expand=False)
+        escaped = literal.str.contains('\\', regex=False, na=False)
+        literal[escaped] = literal[escaped].str.replace(
+            ESCAPE, lambda match: ESCAPES.get(match.group(1), match.group(1)), regex=True)
+
+        df[column] = values.mask(iri, values.str[1:-1]).mask(literal.notna(), literal)
+
+    return _as_text(df)
+
+def _as_text(df):
+    """Every column as text, with unbound variables missing in every format."""
+    return df.astype(dict.fromkeys(df.columns, 'str'))
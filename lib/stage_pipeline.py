@@ -0,0 +1,144 @@
+"""
+Declarative stages of the ETL pipeline with checkpoints between them.
+"""
+import glob
+import hashlib
+import json
+import os
+from collections import namedtuple
+import pandas as pd
+from lib.etl_pipeline import ETLPipeline
+from lib.udb_mapping import as_paths
+
+# A stage runs one step on the pipeline, reports its result and lists the
+# inputs besides the previous stage that its output depends on
+Stage = namedtuple('Stage', ['name', 'run', 'report', 'inputs'])
+
+def _group(pipeline, options):
+    """Group by subject and hash the grouped rows."""
+    count = pipeline.group_by_id(options['group_workers'])
+    pipeline.hash_rows()
+    return count
+
+def _report_certainty(pipeline, certainty):
+    return f"Number of rows per certainty ratio:\n{certainty}\n" \
+        f"Number of fuzzy name pairs applied: {pipeline.fuzzy_pairs_applied}"
+
+STAGES = [
+    Stage('load', lambda pipeline, options: pipeline.load_data(),
+          lambda pipeline, count: f"Initial number of records: {count}",
+          lambda pipeline, options: [file_digest(pipeline.input_csv), pipeline.categorical]),
+    Stage('filter', lambda pipeline, options: pipeline.filter_udb_location_type(),
+          lambda pipeline, count: f"Number of records after filter by UDB type: {count}",
+          lambda pipeline, options: mapping_digests(pipeline)),
+    Stage('group', _group,
+          lambda pipeline, count: f"Number of records after grouping by ID: {count}",
+          lambda pipeline, options: [pipeline.aggregations] if pipeline.aggregations else []),
+    Stage('cleanup', lambda pipeline, options: pipeline.advanced_cleanup_strings(),
+          None, lambda pipeline, options: []),
+    Stage('fill', lambda pipeline, options: pipeline.fill_empty_location_type(),
+          None, lambda pipeline, options: mapping_digests(pipeline)),
+    Stage('remove', lambda pipeline, options: pipeline.remove(options['quarantine_mode']),
+          lambda pipeline, count: "Number of records after removing quarantined records "
+          f"(see {pipeline.quarantine_txt}): {count}",
+          lambda pipeline, options: [file_digest(pipeline.quarantine_txt),
+                                     options['quarantine_mode']]),
+    Stage('dedup', lambda pipeline, options: pipeline.deduplicate_data(options['workers']),
+          _report_certainty,
+          lambda pipeline, options: [pipeline.geo_radius, pipeline.geo_name_threshold]
+          if pipeline.geo_radius else []),
+]
+
+STAGE_NAMES = [stage.name for stage in STAGES]
+
+def file_digest(path):
+    """SHA-256 of a file's contents, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+def mapping_digests(pipeline):
+    """SHA-256 of every mapping file, in merge order."""
+    return [file_digest(path) for path in as_paths(pipeline.mapping_json)]
+
+class StagePipeline:
+    """
+    StagePipeline runs the ETL stages in order and writes the data after
+    every stage to a Feather checkpoint. The checkpoint key chains the
+    input file hash with the name and inputs of every stage so far, so a
+    run can resume from any stage as long as nothing before it changed.
+    Only the latest checkpoint of every stage is kept.
+    """
+
+    def __init__(self, pipeline: ETLPipeline, checkpoint_dir=None, options=None):
+        self.pipeline = pipeline
+        self.checkpoint_dir = checkpoint_dir
+        self.options = {'quarantine_mode': 'substring', 'workers': None, 'group_workers': None,
+                        **(options or {})}
+        self._keys = None
+
+        if checkpoint_dir:
+            os.makedirs(checkpoint_dir, exist_ok=True)
+
+    def keys(self):
+        """The checkpoint key of every stage."""
+        if self._keys is None:
+            key, self._keys = '', []
+            for stage in STAGES:
+                inputs = json.dumps([stage.name, stage.inputs(self.pipeline, self.options)])
+                key = hashlib.sha256(f"{key}\n{inputs}".encode('utf-8')).hexdigest()
+                self._keys.append(key)
+
+        return self._keys
+
+    def checkpoint(self, name):
+        """The checkpoint path of a stage for the current input and configuration."""
+        return os.path.join(self.checkpoint_dir,
+                            f"{name}-{self.keys()[STAGE_NAMES.index(name)][:16]}.feather")
+
+    def can_start_at(self, name):
+        """Whether the checkpoint a run starting at this stage needs exists."""
+        position = STAGE_NAMES.index(name)
+        return position == 0 or (self.checkpoint_dir is not None and
+                                 os.path.exists(self.checkpoint(STAGE_NAMES[position - 1])))
+
+    def run(self, from_stage=None, until_stage=None):
+        """
+        Run the stages from one stage up to and including another.
+        :param from_stage: The first stage to run; the stages before it are
+            restored from the checkpoint of the stage just before it.
+        :param until_stage: The last stage to run.
+        :return: An iterator of (stage, result) tuples, one per stage run.
+        """
+        start = STAGE_NAMES.index(from_stage) if from_stage else 0
+        stop = STAGE_NAMES.index(until_stage) + 1 if until_stage else len(STAGES)
+
+        if start > 0:
+            with self.pipeline.profile('restore'):
+                self.pipeline.data = pd.read_feather(self.checkpoint(STAGE_NAMES[start - 1]))
+
+        for stage in STAGES[start:stop]:
+            with self.pipeline.profile(stage.name):
+                result = stage.run(self.pipeline, self.options)
+
+                if self.checkpoint_dir:
+                    with self.pipeline.profile('checkpoint'):
+                        self._write_checkpoint(stage.name)
+
+            yield stage, result
+
+    def _write_checkpoint(self, name):
+        """Write the checkpoint of a stage and remove those of earlier inputs."""
+        path = self.checkpoint(name)
+        # Feather only stores a default index
+        self.pipeline.data.reset_index(drop=True).to_feather(path)
+
+        # Only the latest checkpoint per stage is kept, so nightly runs on
+        # new inputs do not pile up copies of the data
+        for old in glob.glob(os.path.join(glob.escape(self.checkpoint_dir),
+                                          f"{name}-*.feather")):
+            if old != path:
+                os.remove(old)
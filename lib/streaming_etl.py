@@ -0,0 +1,118 @@
+"""
+End-to-end ETL runs that overlap downloading with the row-local stages.
+"""
+import queue
+import threading
+import pandas as pd
+from lib.etl_pipeline import ETLPipeline
+from lib.table_io import STRING_COLUMNS
+
+class StreamingETL:
+    """
+    StreamingETL downloads every source in a thread of its own and hands
+    the pages to the calling thread through a bounded queue. That thread
+    filters them and removes quarantined subjects while the other downloads
+    go on; a full queue makes the downloads wait. Once all sources are done,
+    grouping, cleanup, fill and deduplication run on the kept rows.
+
+    The rows are put together in source order, not in order of arrival, so
+    the result is the same as running the ETL on the merged downloads.
+    Cleanup waits for grouping, since the content hashes are taken from the
+    grouped rows before cleanup.
+    """
+
+    # pylint: disable=too-few-public-methods
+    def __init__(self, pipeline: ETLPipeline, queue_size: int = 8):
+        self.pipeline = pipeline
+        self.queue_size = queue_size
+
+    def run(self, sources, quarantine_mode='substring', workers=None, group_workers=None):
+        """
+        Download the sources and run the pipeline on their rows.
+        :param sources: A dict of {name: function returning an iterator of
+            DataFrames}, e.g. the pages of a product query.
+        :param quarantine_mode: The mode passed to ETLPipeline.remove.
+        :param workers: The worker processes passed to deduplicate_data.
+        :param group_workers: The worker processes passed to group_by_id.
+        :return: A dict with the rows fetched per source and in total, the
+            record counts after each stage and the rows per certainty ratio.
+        """
+        counts = {'fetched': dict.fromkeys(sources, 0), 'filtered': 0, 'quarantined': 0}
+
+        with self.pipeline.profile('stream'):
+            parts = self._consume(sources, quarantine_mode, counts)
+
+        counts['initial'] = sum(counts['fetched'].values())
+        frames = [frame for name in sources for frame in parts[name]]
+        if not frames:
+            raise RuntimeError("The sources returned no rows")
+
+        self.pipeline.data = pd.concat(frames, ignore_index=True)
+        self.pipeline.apply_schema()
+
+        with self.pipeline.profile('group'):
+            counts['grouped'] = self.pipeline.group_by_id(group_workers)
+            self.pipeline.hash_rows()
+        with self.pipeline.profile('cleanup'):
+            self.pipeline.advanced_cleanup_strings()
+        with self.pipeline.profile('fill'):
+            self.pipeline.fill_empty_location_type()
+        with self.pipeline.profile('dedup'):
+            counts['certainty'] = self.pipeline.deduplicate_data(workers)
+
+        return counts
+
+    def _consume(self, sources, quarantine_mode, counts):
+        """Start a producer per source and filter their pages as they arrive."""
+        pages = queue.Queue(maxsize=self.queue_size)
+        for name, source in sources.items():
+            # Daemon threads do not keep the process alive if the consumer fails
+            threading.Thread(target=_produce, args=(name, source, pages), daemon=True).start()
+
+        parts = {name: [] for name in sources}
+        pending, failed = set(sources), {}
+
+        while pending:
+            name, page = pages.get()
+            if page is None:
+                pending.discard(name)
+            elif isinstance(page, Exception):
+                failed[name] = page
+                pending.discard(name)
+            else:
+                counts['fetched'][name] += len(page)
+                parts[name].append(self._row_local(page, quarantine_mode, counts))
+
+        if failed:
+            # Without a source the deduplication would be incomplete
+            raise RuntimeError(f"Fetching failed for {', '.join(sorted(failed))}") \
+                from next(iter(failed.values()))
+
+        return parts
+
+    def _row_local(self, page, quarantine_mode, counts):
+        """Filter one page and drop its quarantined subjects."""
+        self.pipeline.data = _as_table(page)
+        counts['filtered'] += self.pipeline.filter_udb_location_type()
+        counts['quarantined'] += self.pipeline.remove(quarantine_mode)
+
+        return self.pipeline.data
+
+def _produce(name, source, pages):
+    """Put the pages of a source on the queue, then None or the error that stopped it."""
+    try:
+        for page in source():
+            pages.put((name, page))
+        pages.put((name, None))
+    except Exception as error:  # pylint: disable=broad-exception-caught
+        pages.put((name, error))
+
+def _as_table(page):
+    """
+    A fetched page with the columns and dtypes read_table gives the same
+    rows after a CSV round trip: all query columns, as text, empty values missing.
+    """
+    page = page.reindex(columns=[*STRING_COLUMNS,
+                                 *(column for column in page.columns
+                                   if column not in STRING_COLUMNS)])
+    return page.mask(page.eq('')).astype(dict.fromkeys(STRING_COLUMNS, 'str'))
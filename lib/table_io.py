@@ -0,0 +1,96 @@
+"""
+Reading and writing tables as CSV or Parquet, picked by file extension.
+"""
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+PARQUET_EXTENSIONS = ('.parquet', '.pq')
+
+# Columns returned by the product queries; always text, so postcodes and
+# house numbers are never turned into floats on the way between stages
+STRING_COLUMNS = ['subject', 'locationName', 'locationType', 'fullAddress',
+                  'thoroughfare', 'huisnummer', 'busnummer', 'postCode', 'city',
+                  'gml', 'point', 'bron', 'udbLocationType']
+
+def is_parquet(path):
+    """Whether a path has a Parquet file extension."""
+    return os.path.splitext(path)[1].lower() in PARQUET_EXTENSIONS
+
+def read_table(path, dtype=None):
+    """
+    Read a CSV or Parquet file.
+    :param path: The file path.
+    :param dtype: Extra CSV column dtypes on top of the string columns.
+    :return: A DataFrame.
+    """
+    if is_parquet(path):
+        return pd.read_parquet(path)
+
+    return pd.read_csv(path, dtype={**dict.fromkeys(STRING_COLUMNS, str), **(dtype or {})})
+
+def iter_table(path, chunksize, dtype=None):
+    """
+    Read a CSV or Parquet file in chunks.
+    :param path: The file path.
+    :param chunksize: The number of rows per chunk.
+    :param dtype: Extra CSV column dtypes on top of the string columns.
+    :return: An iterator of DataFrames.
+    """
+    if is_parquet(path):
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+        return
+
+    yield from pd.read_csv(path, chunksize=chunksize,
+                           dtype={**dict.fromkeys(STRING_COLUMNS, str), **(dtype or {})})
+
+def write_table(df, path):
+    """Write a DataFrame to a CSV or Parquet file."""
+    with TableWriter(path) as writer:
+        writer.write(df)
+
+class TableWriter:
+    """
+    TableWriter appends DataFrame chunks to one CSV or Parquet file,
+    writing the CSV header or the Parquet schema with the first chunk.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.parquet_writer = None
+        self.header = True
+
+    def write(self, df):
+        """Append a chunk to the file."""
+        if is_parquet(self.path):
+            table = _to_arrow(df)
+            if self.parquet_writer is None:
+                self.parquet_writer = pq.ParquetWriter(self.path, table.schema)
+            self.parquet_writer.write_table(table.cast(self.parquet_writer.schema))
+        else:
+            df.to_csv(self.path, mode='w' if self.header else 'a',
+                      header=self.header, index=False)
+
+        self.header = False
+
+    def close(self):
+        """Finish the file."""
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def _to_arrow(df):
+    """Convert a DataFrame to an Arrow table with the string columns typed as strings."""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    schema = pa.schema([pa.field(field.name, pa.string()) if field.name in STRING_COLUMNS
+                        else field for field in table.schema],
+                       metadata=table.schema.metadata)
+
+    return table.cast(schema)
@@ -0,0 +1,63 @@
+"""
+UDB location type mappings compiled into arrays for vectorized lookups.
+"""
+import json
+import numpy as np
+import pandas as pd
+
+def as_paths(mapping_json):
+    """The mapping files of one path or a list of paths, in merge order."""
+    return [mapping_json] if isinstance(mapping_json, str) else list(mapping_json)
+
+class UdbMapping:
+    """
+    UdbMapping holds the UDB terms as an index and their location types as
+    an array at the same positions. Lookups factorize a column first, so
+    every distinct value or category is looked up once and each row only
+    costs an integer take, whatever the size of the taxonomy.
+    """
+
+    def __init__(self, mapping):
+        self.terms = pd.Index(list(mapping), dtype=object)
+        # A trailing NaN is the location type of code -1, for unknown terms
+        self.location_types = np.array([*mapping.values(), np.nan], dtype=object)
+
+    @classmethod
+    def load(cls, mapping_json, read=None):
+        """
+        Merge one or more JSON mapping files; later files override the
+        location type of terms that earlier files map too.
+        :param mapping_json: A path or a list of paths.
+        :param read: A function reading one file into a dict, json.load by default.
+        """
+        merged = {}
+        for path in as_paths(mapping_json):
+            if read is None:
+                with open(path, 'r', encoding='utf-8') as file:
+                    merged.update(json.load(file))
+            else:
+                merged.update(read(path))
+
+        return cls(merged)
+
+    def __len__(self):
+        return len(self.terms)
+
+    def codes(self, values):
+        """The position of every value in the terms; -1 for unknown and missing values."""
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            codes, uniques = values.cat.codes.to_numpy(), values.cat.categories
+        else:
+            codes, uniques = pd.factorize(values)
+
+        # Missing values have code -1, which picks the -1 appended last
+        return np.append(self.terms.get_indexer(uniques), -1)[codes]
+
+    def known(self, values):
+        """A mask of the values that are missing or have a mapping."""
+        return (self.codes(values) >= 0) | values.isna().to_numpy()
+
+    def lookup(self, values):
+        """The location type of every value, NaN where there is none, as an object Series."""
+        return pd.Series(self.location_types[self.codes(values)], index=values.index,
+                         dtype=object)
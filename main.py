@@ -7,10 +7,24 @@ This module provides command-line interfaces for:
 - Running an ETL pipeline to cleanse and process data.
 """
 
+# Every command imports the libraries it needs itself, so a command does not
+# pay for pandas, rapidfuzz or the OAuth client unless it uses them.
+# pylint: disable=import-outside-toplevel
+
 import argparse
-from lib.linked_data_api import LinkedDataAPI
-from lib.data_cruncher import DataCruncher
-from lib.etl_pipeline import ETLPipeline
+import contextlib
+import json
+import os
+import shlex
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Rows per page of --run without --page-size, so pages of one product overlap with the ETL
+STREAMING_PAGE_SIZE = 10000
+
+class UsageError(Exception):
+    """Arguments that do not make a command: the message says what is missing."""
 
 def head(limit: int = 5):
     """
@@ -255,74 +269,559 @@ queries = {
         }"""
 }
 
-def main():
+def make_cache(args):
     """
-    Main function to handle command-line arguments and execute the required tasks.
+    Creates the response cache for product fetches.
+
+    Args:
+        args (argparse.Namespace): Parsed command-line arguments.
+
+    Returns:
+        ResponseCache: The cache, or None when disabled with --no-cache.
     """
 
-    parser = argparse.ArgumentParser()
-    parser.add_argument('-p', '--product', help='the data product to fetch.')
-    parser.add_argument('-f', '--file', help='the file to write the data to.')
-    parser.add_argument('-m', '--merge', nargs='+', help='the CSV files to merge.')
-    parser.add_argument('--etl', help='CJI specifc ETL pipeline to cleanse the data.')
-    parser.add_argument('-i', '--input', help='Input CSV file for the ETL pipeline.')
+    from lib.response_cache import ResponseCache
 
-    args = parser.parse_args()
+    if args.no_cache:
+        return None
 
-    if args.etl:
-        print("Running ETL pipeline")
+    return ResponseCache(args.cache_dir, args.cache_ttl)
+
+def make_pipeline(args, input_path):
+    """
+    Creates the ETL pipeline with the configuration of the arguments.
+
+    Args:
+        args (argparse.Namespace): Parsed command-line arguments.
+        input_path (str): The input file, or None when the data is fetched.
 
-        if not args.input:
-            print("Please provide an input CSV file for the ETL pipeline.")
-            return
+    Returns:
+        ETLPipeline: The pipeline.
 
-        pipeline = ETLPipeline(args.input, "conf/udbmappings.json")
-        pipeline.load_data()
+    Raises:
+        UsageError: When an aggregation is not of the form COLUMN=RULE.
+    """
 
-        initial_count = pipeline.load_data()
-        print(f"Initial number of records: {initial_count}")
+    from lib.etl_pipeline import ETLPipeline
+    from lib.fuzzy_index import FuzzyPairIndex
 
-        filtered_count = pipeline.filter_udb_location_type()
-        print(f"Number of records after filter by UDB type: {filtered_count}")
+    aggregations = [rule.split('=', 1) for rule in args.aggregate or []]
+    if any(len(rule) != 2 for rule in aggregations):
+        raise UsageError("Aggregations take the form COLUMN=RULE, e.g. bron=concat_distinct.")
 
-        grouped_count = pipeline.group_by_id()
-        print(f"Number of records after grouping by ID: {grouped_count}")
+    pipeline = ETLPipeline(input_path, args.mapping, args.quarantine)
+    pipeline.categorical = not args.no_categorical
+    pipeline.aggregations = dict(aggregations)
+    pipeline.geo_radius = args.geo_radius
+    pipeline.geo_name_threshold = args.geo_name_threshold
+    if not args.no_fuzzy_index:
+        pipeline.fuzzy_index = FuzzyPairIndex(args.fuzzy_index_dir,
+                                              max_names=args.fuzzy_index_max_names)
 
-        pipeline.advanced_cleanup_strings()
-        pipeline.fill_empty_location_type()
+    return pipeline
 
-        quarantine_count = pipeline.remove()
-        print(f"Number of records after removing \
-            quarantined records (see to_remove.txt): {quarantine_count}")
+def run_profiled(pipeline, args, stages):
+    """
+    Runs the stages, with a StageProfiler attached when a profile is requested.
 
-        deduplicated_count = pipeline.deduplicate_data()
-        print("Number of rows per certainty ratio:")
-        print(deduplicated_count)
+    Args:
+        pipeline (ETLPipeline): The pipeline to profile.
+        args (argparse.Namespace): Parsed command-line arguments.
+        stages (callable): Runs the stages on the pipeline and arguments.
+    """
+
+    from lib.profiler import StageProfiler
 
-        pipeline.save_data()
+    if not (args.profile or args.profile_stats):
+        stages(pipeline, args)
         return
 
-    if args.merge:
-        print("Merging files: ", args.merge)
-        DataCruncher.merge(args.merge)
+    pipeline.profiler = StageProfiler(args.trace_memory, bool(args.profile_stats))
+    pipeline.profiler.start()
+    try:
+        stages(pipeline, args)
+    finally:
+        pipeline.profiler.stop()
+
+        if args.profile:
+            pipeline.profiler.write(args.profile)
+            print(f"Profile written to {args.profile}")
+        if args.profile_stats:
+            pipeline.profiler.dump_stats(args.profile_stats)
+            print(f"Profile statistics written to {args.profile_stats}")
+
+def run_etl(args):
+    """
+    Runs the CJI ETL pipeline on the input file.
+
+    Args:
+        args (argparse.Namespace): Parsed command-line arguments.
+    """
+
+    from lib.stage_pipeline import STAGE_NAMES
+
+    print("Running ETL pipeline")
+
+    if not args.input:
+        raise UsageError("Please provide an input CSV file for the ETL pipeline.")
+
+    for stage in (args.from_stage, args.until_stage):
+        if stage and stage not in STAGE_NAMES:
+            raise UsageError(f"Unknown stage {stage}; the stages are {', '.join(STAGE_NAMES)}.")
+
+    run_profiled(make_pipeline(args, args.input), args, run_etl_stages)
+
+def run_etl_stages(pipeline, args):
+    """
+    Runs the ETL stages in memory, in chunks or incrementally.
+
+    Args:
+        pipeline (ETLPipeline): The pipeline with the input and configuration.
+        args (argparse.Namespace): Parsed command-line arguments.
+    """
+
+    from lib.schema import memory_report
+    from lib.stage_pipeline import STAGE_NAMES, StagePipeline
+
+    if args.chunksize:
+        with pipeline.profile('chunked'):
+            run_chunked_etl(pipeline, args)
         return
 
-    if not args.product:
-        print("Please provide a data product to fetch: publiq, \
-              jeugdmaps, kiosk, erfgoed, kampas, anb")
+    if args.from_stage and not args.checkpoint_dir:
+        raise UsageError("Resuming at a stage needs the --checkpoint-dir of an earlier run.")
+
+    stages = StagePipeline(pipeline, args.checkpoint_dir,
+                           {'quarantine_mode': args.quarantine_mode, 'workers': args.processes,
+                            'group_workers': args.group_processes})
+
+    if args.from_stage and not stages.can_start_at(args.from_stage):
+        raise UsageError(f"No checkpoint to start at stage {args.from_stage} for this input "
+                         "and configuration; run the stages before it first.")
+
+    # An incremental run takes over after grouping
+    until_stage = 'group' if args.previous else args.until_stage or STAGE_NAMES[-1]
+
+    if args.from_stage and STAGE_NAMES.index(args.from_stage) > STAGE_NAMES.index(until_stage):
+        raise UsageError(f"Stage {args.from_stage} comes after stage {until_stage}.")
+
+    for stage, result in stages.run(args.from_stage, until_stage):
+        if stage.report:
+            print(stage.report(pipeline, result))
+
+    if args.previous:
+        with pipeline.profile('incremental'):
+            run_incremental_etl(pipeline, args)
         return
 
+    if until_stage != STAGE_NAMES[-1]:
+        print(f"Stopped after stage {until_stage}")
+        return
+
+    if args.memory_report:
+        print(memory_report(pipeline.data).to_string(na_rep=''))
+
+    with pipeline.profile('save'):
+        pipeline.save_data(args.file or "cleansed.csv")
+
+def run_chunked_etl(pipeline, args):
+    """
+    Runs the ETL pipeline out of core, in chunks and hash partitions.
+
+    Args:
+        pipeline (ETLPipeline): The pipeline with the input and configuration.
+        args (argparse.Namespace): Parsed command-line arguments.
+    """
+
+    from lib.chunked_etl import ChunkedETL
+
+    counts = ChunkedETL(pipeline, args.chunksize, args.partitions) \
+        .run(args.file or "cleansed.csv", args.quarantine_mode)
+
+    print(f"Initial number of records: {counts['initial']}")
+    print(f"Number of records after filter by UDB type: {counts['filtered']}")
+    print(f"Number of records after removing \
+        quarantined records (see {args.quarantine}): {counts['quarantined']}")
+    print(f"Number of records after grouping by ID: {counts['grouped']}")
+    print("Number of rows per certainty ratio:")
+    print(counts['certainty'])
+
+def run_incremental_etl(pipeline, args):
+    """
+    Runs the rest of the ETL pipeline on the subjects that changed since
+    the previous cleansed output.
+
+    Args:
+        pipeline (ETLPipeline): The pipeline with the grouped and hashed data.
+        args (argparse.Namespace): Parsed command-line arguments.
+    """
+
+    from lib.incremental_etl import IncrementalETL
+
+    counts = IncrementalETL(pipeline).run(args.previous, args.quarantine_mode, args.processes)
+
+    print(f"Number of new subjects: {counts['new']}")
+    print(f"Number of changed subjects: {counts['changed']}")
+    print(f"Number of removed subjects: {counts['removed']}")
+    print(f"Number of unchanged subjects: {counts['unchanged']}")
+    print(f"Number of records deduplicated again: {counts['recomputed']}")
+
+    pipeline.save_data(args.file or "cleansed.csv")
+
+def fetch_product(args):
+    """
+    Fetches a data product and optionally writes it to a CSV file.
+
+    Args:
+        args (argparse.Namespace): Parsed command-line arguments.
+    """
+
+    import httpx
+    from lib.linked_data_api import LinkedDataAPI
+    from lib.table_io import TableWriter, write_table
+
     api = LinkedDataAPI()
     api.set_data_endpoint(endpoints[args.product])
     api.set_query(queries[args.product])
-    df = api.fetch_data()
+    api.set_result_format(args.format)
+    api.set_cache(make_cache(args))
+
+    if args.page_size and api.cache is None:
+        # Stream every page to the file as soon as it arrives
+        rows = 0
+        try:
+            with TableWriter(args.file or os.devnull) as writer:
+                for page in api.fetch_pages(args.page_size, args.workers):
+                    writer.write(page)
+                    rows += len(page)
+        except httpx.HTTPStatusError as error:
+            # Reported like a failed fetch_data, without a partial file left behind
+            print(error)
+            if args.file and os.path.exists(args.file):
+                os.remove(args.file)
+            raise RuntimeError(f"Fetching {args.product} failed") from error
+        print(f"Number of records fetched: {rows}")
+        return
+
+    df = api.fetch_data(args.page_size, args.workers)
+    if df is None:
+        raise RuntimeError(f"Fetching {args.product} failed")
 
     # If a filename is provided as a command line argument,
-    # write the data to a CSV file
+    # write the data to a CSV or Parquet file
     if args.file:
-        df.to_csv(args.file, index=False)
+        write_table(df, args.file)
 
     print(df)
 
+def fetch_all(args):
+    """
+    Fetches every data product concurrently over one shared authenticated client.
+
+    Args:
+        args (argparse.Namespace): Parsed command-line arguments.
+    """
+
+    from lib.linked_data_api import LinkedDataAPI
+    from lib.table_io import write_table
+
+    client = LinkedDataAPI().client
+    cache = make_cache(args)
+    products = [product for product in endpoints if product in queries]
+
+    def fetch(product):
+        start = time.perf_counter()
+
+        api = LinkedDataAPI(client)
+        api.set_data_endpoint(endpoints[product])
+        api.set_query(queries[product])
+        api.set_result_format(args.format)
+        api.set_cache(cache)
+        try:
+            df = api.fetch_data(args.page_size, args.workers)
+            if df is not None:
+                write_table(df, os.path.join(args.output_dir, f"{product}.{args.output_format}"))
+        except Exception as error:  # pylint: disable=broad-exception-caught
+            # One failing product must not stop the report of the others
+            return None, time.perf_counter() - start, error
+
+        return df, time.perf_counter() - start, None
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=len(products)) as executor:
+        for product, (df, elapsed, error) in zip(products, executor.map(fetch, products)):
+            if df is None:
+                failed.append(product)
+                reason = f" ({type(error).__name__}: {error})" if error else ""
+                print(f"{product}: failed after {elapsed:.1f}s{reason}")
+            else:
+                print(f"{product}: {len(df)} records in {elapsed:.1f}s")
+
+    if failed:
+        raise RuntimeError(f"Fetching failed for {', '.join(failed)}")
+
+def run_all(args):
+    """
+    Fetches every data product and runs the ETL pipeline on the rows while
+    the products download.
+
+    Args:
+        args (argparse.Namespace): Parsed command-line arguments.
+    """
+
+    print("Running ETL pipeline on all data products")
+
+    run_profiled(make_pipeline(args, None), args, run_streaming_etl)
+
+def run_streaming_etl(pipeline, args):
+    """
+    Streams the pages of every data product through the ETL pipeline.
+
+    Args:
+        pipeline (ETLPipeline): The pipeline with the configuration.
+        args (argparse.Namespace): Parsed command-line arguments.
+    """
+
+    from lib.linked_data_api import LinkedDataAPI
+    from lib.schema import memory_report
+    from lib.streaming_etl import StreamingETL
+
+    client = LinkedDataAPI().client
+    cache = make_cache(args)
+    page_size = args.page_size or STREAMING_PAGE_SIZE
+
+    def source(product):
+        def pages():
+            api = LinkedDataAPI(client)
+            api.set_data_endpoint(endpoints[product])
+            api.set_query(queries[product])
+            api.set_result_format(args.format)
+            api.set_cache(cache)
+
+            if cache is None:
+                yield from api.fetch_pages(page_size, args.workers)
+                return
+
+            # Cached results are stored whole, so they reach the ETL at once
+            df = api.fetch_data(page_size, args.workers)
+            if df is None:
+                raise RuntimeError(f"No data returned for {product}")
+            yield df
+
+        return pages
+
+    sources = {product: source(product) for product in endpoints if product in queries}
+    counts = StreamingETL(pipeline, args.queue_size) \
+        .run(sources, args.quarantine_mode, args.processes, args.group_processes)
+
+    for product, rows in counts['fetched'].items():
+        print(f"{product}: {rows} records")
+    print(f"Initial number of records: {counts['initial']}")
+    print(f"Number of records after filter by UDB type: {counts['filtered']}")
+    print(f"Number of records after removing \
+        quarantined records (see {args.quarantine}): {counts['quarantined']}")
+    print(f"Number of records after grouping by ID: {counts['grouped']}")
+    print("Number of rows per certainty ratio:")
+    print(counts['certainty'])
+
+    if args.memory_report:
+        print(memory_report(pipeline.data).to_string(na_rep=''))
+
+    with pipeline.profile('save'):
+        pipeline.save_data(args.file or "cleansed.csv")
+
+def make_parser():
+    """
+    Creates the command-line parser, shared by the command line and the worker.
+
+    Returns:
+        argparse.ArgumentParser: The parser.
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-p', '--product', help='the data product to fetch.')
+    parser.add_argument('-f', '--file', help='the file to write the data to (.csv or .parquet).')
+    parser.add_argument('-a', '--all', action='store_true',
+                        help='fetch all data products concurrently.')
+    parser.add_argument('--run', action='store_true',
+                        help='fetch all data products and run the ETL pipeline on them '
+                        'while they download; pages of one product only overlap with the '
+                        'ETL with --no-cache, cached products arrive whole.')
+    parser.add_argument('--queue-size', type=int, default=8,
+                        help='number of fetched pages that may wait for the ETL with --run.')
+    parser.add_argument('-o', '--output-dir', default='.',
+                        help='the directory to write the products to with --all.')
+    parser.add_argument('--format', default='json', choices=['json', 'csv', 'tsv'],
+                        help='the SPARQL result format to request.')
+    parser.add_argument('--output-format', default='csv', choices=['csv', 'parquet'],
+                        help='the file format of the products written with --all.')
+    parser.add_argument('--page-size', type=int,
+                        help='fetch the product in pages of this many rows; --run uses '
+                        f'pages of {STREAMING_PAGE_SIZE} rows by default.')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='number of pages to fetch concurrently.')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='always download, bypassing the local response cache.')
+    parser.add_argument('--cache-dir', default='.cache/sparql',
+                        help='the directory of the local response cache.')
+    parser.add_argument('--cache-ttl', type=int, default=3600,
+                        help='seconds before a cached response is revalidated.')
+    parser.add_argument('-m', '--merge', nargs='+', help='the CSV files to merge.')
+    parser.add_argument('--chunksize', type=int,
+                        help='stream the input files in chunks of this many rows (merge and ETL).')
+    parser.add_argument('--partitions', type=int, default=16,
+                        help='number of on-disk partitions for the chunked ETL pipeline.')
+    parser.add_argument('--processes', type=int,
+                        help='number of processes for the ETL deduplication.')
+    parser.add_argument('--group-processes', type=int,
+                        help='number of processes for grouping repeated ETL subjects.')
+    parser.add_argument('--aggregate', action='append', metavar='COLUMN=RULE',
+                        help='how grouping combines a column: first (default), '
+                        'first_non_empty or concat_distinct; may be repeated.')
+    parser.add_argument('--etl', help='CJI specifc ETL pipeline to cleanse the data.')
+    parser.add_argument('-i', '--input', help='Input CSV or Parquet file for the ETL pipeline.')
+    parser.add_argument('--from-stage', metavar='STAGE',
+                        help='resume the ETL pipeline at this stage from its checkpoints '
+                        '(load, filter, group, cleanup, fill, remove or dedup).')
+    parser.add_argument('--until-stage', metavar='STAGE',
+                        help='stop the ETL pipeline after this stage.')
+    parser.add_argument('--checkpoint-dir',
+                        help='write ETL stage checkpoints to this directory, '
+                        'e.g. .cache/checkpoints, to resume or stop at a stage later.')
+    parser.add_argument('--geo-radius', type=float,
+                        help='also match locations within this many metres with similar names.')
+    parser.add_argument('--geo-name-threshold', type=int, default=80,
+                        help='name similarity (0-100) that confirms a match within --geo-radius.')
+    parser.add_argument('--fuzzy-index-dir', default='.cache/fuzzy',
+                        help='the directory of the fuzzy name pairs scored in earlier ETL runs.')
+    parser.add_argument('--fuzzy-index-max-names', type=int, default=1_000_000,
+                        help='rebuild the fuzzy name index with the names of the current run '
+                        'once it holds more names than this.')
+    parser.add_argument('--no-fuzzy-index', action='store_true',
+                        help='score all fuzzy name pairs again, without the index.')
+    parser.add_argument('--no-categorical', action='store_true',
+                        help='keep low-cardinality ETL columns as strings instead of categoricals.')
+    parser.add_argument('--memory-report', action='store_true',
+                        help='print the memory per text column as strings and categoricals.')
+    parser.add_argument('--profile',
+                        help='write a JSON report of the time, memory and rows per ETL stage.')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='add the peak traced Python memory per stage to the profile; '
+                        'slows the ETL down.')
+    parser.add_argument('--profile-stats',
+                        help='write cProfile statistics of the ETL pipeline, for pstats.')
+    parser.add_argument('--previous',
+                        help='previous cleansed output to update incrementally (ETL); '
+                        'after input changes, fuzzy links to names outside the redone '
+                        'postCode blocks can differ from a full run.')
+    parser.add_argument('--mapping', nargs='+', default=['conf/udbmappings.json'],
+                        help='UDB mapping JSON files for the ETL pipeline; later files '
+                        'override the location types of earlier ones.')
+    parser.add_argument('--quarantine', default='conf/to_remove.txt',
+                        help='File with the subjects to remove in the ETL pipeline.')
+    parser.add_argument('--quarantine-mode', default='substring',
+                        choices=['exact', 'prefix', 'substring'],
+                        help='How subjects are matched against the quarantine file.')
+    parser.add_argument('--worker', action='store_true',
+                        help='run jobs read from stdin, one command line per line, '
+                        'in one long-lived process.')
+
+    return parser
+
+def run(args):
+    """
+    Runs the command selected by the parsed arguments.
+
+    Args:
+        args (argparse.Namespace): Parsed command-line arguments.
+
+    Raises:
+        UsageError: When the arguments do not make a command.
+    """
+
+    if args.run:
+        run_all(args)
+        return
+
+    if args.etl:
+        run_etl(args)
+        return
+
+    if args.merge:
+        from lib.data_cruncher import DataCruncher
+
+        print("Merging files: ", args.merge)
+        DataCruncher.merge(args.merge, args.file or 'merged.csv', args.chunksize)
+        return
+
+    if args.all:
+        fetch_all(args)
+        return
+
+    if not args.product:
+        raise UsageError("Please provide a data product to fetch: publiq, "
+                         "jeugdmaps, kiosk, erfgoed, kampas, anb")
+
+    fetch_product(args)
+
+def run_worker(parser):
+    """
+    Runs jobs from stdin in one warm process until stdin closes.
+
+    Every line holds the arguments of one command, as on the command line,
+    e.g. `--etl cji -i input.csv -f output.parquet`. The output of the jobs
+    goes to stderr; stdout gets one JSON line per job with its status and
+    duration. Imported libraries, the parsed UDB mapping and the compiled
+    quarantine list stay in memory between jobs.
+
+    Args:
+        parser (argparse.ArgumentParser): The parser for the job arguments.
+    """
+
+    # Import the ETL libraries once, before the first job
+    import lib.etl_pipeline  # pylint: disable=unused-import
+
+    print(json.dumps({'status': 'ready'}), flush=True)
+
+    for number, line in enumerate(sys.stdin, 1):
+        if not line.strip():
+            continue
+
+        result = {'job': number, 'args': line.strip()}
+        start = time.perf_counter()
+        try:
+            with contextlib.redirect_stdout(sys.stderr):
+                args = parser.parse_args(shlex.split(line))
+                if args.worker:
+                    raise ValueError("A worker job cannot start another worker")
+                run(args)
+            result['status'] = 'ok'
+        except SystemExit as error:
+            # argparse exits on invalid arguments
+            result.update(status='error', error=f"invalid arguments (exit status {error.code})")
+        except Exception as error:  # pylint: disable=broad-exception-caught
+            # One failing job must not stop the worker
+            result.update(status='error', error=f"{type(error).__name__}: {error}")
+
+        result['seconds'] = round(time.perf_counter() - start, 3)
+        print(json.dumps(result), flush=True)
+
+def main():
+    """
+    Main function to handle command-line arguments and execute the required tasks.
+    """
+
+    parser = make_parser()
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(parser)
+        return
+
+    try:
+        run(args)
+    except UsageError as error:
+        sys.exit(str(error))
+
 if __name__ == "__main__":
     main()
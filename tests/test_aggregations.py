@@ -0,0 +1,59 @@
+"""
+Tests of the grouping aggregations on missing, empty and repeated values.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from lib.etl_pipeline import _aggregate
+
+@pytest.fixture(name='rows')
+def fixture_rows():
+    """Rows of three subjects, out of subject order, with missing and empty names."""
+    return pd.DataFrame({
+        'subject': ['b', 'a', 'b', 'c', 'a', 'b', 'c', 'a', 'b'],
+        'locationName': ['', np.nan, 'Zaal', '', 'Hal', np.nan, np.nan, '', 'Kerk'],
+        'city': ['Gent'] * 9})
+
+def aggregated(rows, rule, dtype):
+    """The aggregated names per subject, with the names in a dtype."""
+    rows = rows.astype({'locationName': dtype})
+    return _aggregate(rows, {'locationName': rule}).set_index('subject')['locationName']
+
+@pytest.mark.parametrize('dtype', [object, 'str', 'category'])
+def test_first_non_empty(rows, dtype):
+    """Empty and missing values are skipped; an all-empty subject keeps 'first'."""
+    names = aggregated(rows, 'first_non_empty', dtype)
+    first = aggregated(rows, 'first', dtype)
+
+    assert names['a'] == 'Hal'
+    assert names['b'] == 'Zaal'
+    assert names['c'] == first['c'] == ''
+
+@pytest.mark.parametrize('dtype', [object, 'str', 'category'])
+def test_concat_distinct(rows, dtype):
+    """Distinct non-empty values in order of appearance; an all-empty subject keeps 'first'."""
+    names = aggregated(rows, 'concat_distinct', dtype)
+
+    assert names['a'] == 'Hal'
+    assert names['b'] == 'Zaal | Kerk'
+    assert names['c'] == ''
+
+def test_concat_distinct_keeps_order_of_appearance():
+    """Values are neither sorted nor repeated, whatever the subject order."""
+    rows = pd.DataFrame({'subject': ['x', 'y', 'x', 'x', 'y', 'x'],
+                         'locationName': ['Markt', 'B', 'Abdij', 'Markt', 'A', 'Zuid'],
+                         'city': ['Gent'] * 6})
+    names = aggregated(rows, 'concat_distinct', object)
+
+    assert names['x'] == 'Markt | Abdij | Zuid'
+    assert names['y'] == 'B | A'
+
+def test_all_missing_subject():
+    """A subject with only missing values stays missing."""
+    rows = pd.DataFrame({'subject': ['a', 'a', 'b'], 'locationName': [np.nan, np.nan, 'Hal'],
+                         'city': ['Gent'] * 3})
+
+    for rule in ['first_non_empty', 'concat_distinct']:
+        names = aggregated(rows, rule, object)
+        assert pd.isna(names['a'])
+        assert names['b'] == 'Hal'
@@ -0,0 +1,40 @@
+"""
+Tests that the out-of-core pipeline writes what the in-memory pipeline does.
+"""
+import os
+import pandas as pd
+import pytest
+from lib.chunked_etl import ChunkedETL
+from lib.etl_pipeline import ETLPipeline
+from lib.stage_pipeline import STAGE_NAMES, StagePipeline
+from lib.table_io import read_table
+
+SAMPLE = os.path.join(os.path.dirname(__file__), 'data', 'locations-1000.csv')
+
+def make_pipeline():
+    """A pipeline on the sample with the repository's mapping and quarantine list."""
+    return ETLPipeline(SAMPLE, 'conf/udbmappings.json', 'conf/to_remove.txt')
+
+@pytest.fixture(name='in_memory', scope='module')
+def fixture_in_memory(tmp_path_factory):
+    """The in-memory output for the sample, as read back from CSV."""
+    pipeline = make_pipeline()
+    options = {'quarantine_mode': 'substring', 'workers': None, 'group_workers': None}
+    for _ in StagePipeline(pipeline, None, options).run(None, STAGE_NAMES[-1]):
+        pass
+
+    output = tmp_path_factory.mktemp('memory') / 'cleansed.csv'
+    pipeline.save_data(str(output))
+    return read_table(str(output))
+
+@pytest.mark.parametrize('partitions', [1, 3, 16])
+def test_chunked_output_matches_in_memory(in_memory, tmp_path, partitions):
+    """Neither the chunks nor the number of partitions change the output."""
+    output = str(tmp_path / 'cleansed.csv')
+    ChunkedETL(make_pipeline(), 200, partitions).run(output)
+    chunked = read_table(output)
+
+    assert (chunked['certainty_ratio'] == 0.5).sum() == (in_memory['certainty_ratio'] == 0.5).sum()
+    pd.testing.assert_frame_equal(
+        chunked.sort_values('subject', ignore_index=True),
+        in_memory.sort_values('subject', ignore_index=True))
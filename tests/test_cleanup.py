@@ -0,0 +1,83 @@
+"""
+Parity tests of the vectorized string cleanup against the per-row rules it replaced.
+"""
+import os
+import re
+import numpy as np
+import pandas as pd
+import pytest
+from lib.etl_pipeline import ETLPipeline
+from lib.table_io import read_table
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+
+def advanced_clean_location_name(name):
+    """The per-row location name cleanup before vectorizing."""
+    name = str(name)
+    name = re.sub(r'\d', '', name)
+    name = name.replace('’', "'").replace('‘', "'").replace('“', '"').replace('”', '"')
+    name = name.replace("'T", "'t").replace("&#039;t", "'t").replace("&#;t", "'t")
+    if name in ["'", "/", "?"]:
+        name = ""
+    name = re.sub(r'[?/-]', ' ', name).strip()
+    name = re.sub(r'\s+', ' ', name)
+    return name
+
+def replace_decimal_zeros(value):
+    """The per-row postcode cleanup before vectorizing."""
+    try:
+        if isinstance(value, str) and value.endswith('.0'):
+            value = str(int(float(value)))
+        return value
+    except ValueError:
+        return value
+
+def strip_quotes(value):
+    """The per-row quote stripping before vectorizing."""
+    if isinstance(value, str):
+        if (value.startswith("'") and value.endswith("'")) or \
+            (value.startswith('"') and value.endswith('"')):
+            value = value[1:-1]
+    return value
+
+def cleanup(df, categorical):
+    """Run the pipeline's cleanup stage on a copy of df."""
+    pipeline = ETLPipeline(None, None)
+    pipeline.data = df.copy()
+    pipeline.categorical = categorical
+    pipeline.apply_schema()
+    pipeline.advanced_cleanup_strings()
+    return pipeline.data
+
+def expected(df):
+    """The cleanup of the per-row rules."""
+    return (df['locationName'].apply(advanced_clean_location_name).apply(strip_quotes),
+            df['postCode'].apply(replace_decimal_zeros))
+
+def assert_same(actual, expected_values):
+    """Equal values, whatever the dtype; None and NaN are both written as empty fields."""
+    pd.testing.assert_series_equal(actual.astype(object).where(actual.notna(), np.nan),
+                                   expected_values.astype(object)
+                                   .where(expected_values.notna(), np.nan),
+                                   check_names=False)
+
+@pytest.mark.parametrize('name', ['locations-1000.csv', 'location-names.csv'])
+@pytest.mark.parametrize('categorical', [False, True])
+def test_cleanup_matches_per_row_rules(name, categorical):
+    """Every sample name and postcode cleans as it did per row."""
+    df = read_table(os.path.join(DATA, name))
+    names, postcodes = expected(df)
+    cleaned = cleanup(df, categorical)
+
+    assert_same(cleaned['locationName'], names)
+    assert_same(cleaned['postCode'], postcodes)
+
+def test_missing_values_keep_their_kind():
+    """None and NaN are different values to the per-row rules."""
+    df = pd.DataFrame({'locationName': pd.Series(['Zaal 1', None, np.nan, None], dtype=object),
+                       'postCode': pd.Series(['1000.0', None, np.nan, '1000.0'], dtype=object)})
+    names, postcodes = expected(df)
+    cleaned = cleanup(df, False)
+
+    assert cleaned['locationName'].tolist() == names.tolist() == ['Zaal', 'None', 'nan', 'None']
+    assert_same(cleaned['postCode'], postcodes)
@@ -0,0 +1,43 @@
+"""
+Tests that merging in chunks writes the bytes of merging in memory.
+"""
+import pandas as pd
+import pytest
+from lib.data_cruncher import DataCruncher
+
+# Column n is int in the first file; the second file decides what it becomes
+SECOND_FILES = {
+    'float': 'n,name\n7,Zaal\n2.5,Hal\n,\n4,Kerk\n',
+    'str': 'n,name\n7,Zaal\nx,Hal\n3,\n8,Kerk\n',
+    'missing': 'name,flag\nZaal,True\nHal,False\nKerk,True\n',
+}
+
+@pytest.mark.parametrize('second', list(SECOND_FILES))
+@pytest.mark.parametrize('chunksize', [1, 2, 3])
+def test_chunked_merge_matches_in_memory(tmp_path, second, chunksize):
+    """A column that is int in one file and float, text or absent in another."""
+    files = [tmp_path / 'first.csv', tmp_path / 'second.csv', tmp_path / 'third.csv']
+    files[0].write_text('n,name,flag\n1,Plein,True\n2,Markt,False\n3,Park,True\n'
+                        '4,Ring,False\n5,Dok,True\n', encoding='utf-8')
+    files[1].write_text(SECOND_FILES[second], encoding='utf-8')
+    # The first chunks of the last file look numeric, a later one does not
+    files[2].write_text('n,name\n9,1\n10,2\n11,Straat\n', encoding='utf-8')
+    paths = [str(path) for path in files]
+
+    DataCruncher.merge(paths, str(tmp_path / 'memory.csv'))
+    DataCruncher.merge(paths, str(tmp_path / 'chunked.csv'), chunksize)
+
+    assert (tmp_path / 'chunked.csv').read_bytes() == (tmp_path / 'memory.csv').read_bytes()
+
+def test_chunked_merge_matches_in_memory_parquet(tmp_path):
+    """Parquet output has the schema and rows of the in-memory merge."""
+    files = [tmp_path / 'first.csv', tmp_path / 'second.csv']
+    files[0].write_text('n,name\n1,Plein\n2,Markt\n3,Park\n', encoding='utf-8')
+    files[1].write_text(SECOND_FILES['float'], encoding='utf-8')
+    paths = [str(path) for path in files]
+
+    DataCruncher.merge(paths, str(tmp_path / 'memory.parquet'))
+    DataCruncher.merge(paths, str(tmp_path / 'chunked.parquet'), 2)
+
+    pd.testing.assert_frame_equal(pd.read_parquet(tmp_path / 'chunked.parquet'),
+                                  pd.read_parquet(tmp_path / 'memory.parquet'))
@@ -0,0 +1,83 @@
+"""
+Tests that the faster deduplication paths find what the plain ones do.
+"""
+import os
+import pandas as pd
+import pytest
+from rapidfuzz import fuzz, process
+from lib.etl_pipeline import ETLPipeline
+from lib.stage_pipeline import StagePipeline
+
+SAMPLE = os.path.join(os.path.dirname(__file__), 'data', 'locations-1000.csv')
+
+@pytest.fixture(name='prepared', scope='module')
+def fixture_prepared():
+    """The sample after every stage before deduplication."""
+    pipeline = ETLPipeline(SAMPLE, 'conf/udbmappings.json', 'conf/to_remove.txt')
+    for _ in StagePipeline(pipeline).run(until_stage='remove'):
+        pass
+
+    return pipeline.data
+
+def deduplicated(df, workers):
+    """The deduplicated rows and sorted duplicate links of a copy of the rows."""
+    pipeline = ETLPipeline(None, None)
+    pipeline.data = df.copy()
+    pipeline.deduplicate_data(workers)
+    links = pipeline.duplicate_links.sort_values(['subject', 'duplicate_subject'],
+                                                 ignore_index=True)
+
+    return pipeline.data, links
+
+def assert_sharded_matches(df, workers):
+    """Deduplicating over worker processes gives the result of one process."""
+    data, links = deduplicated(df, None)
+    sharded_data, sharded_links = deduplicated(df, workers)
+
+    pd.testing.assert_frame_equal(sharded_data, data)
+    pd.testing.assert_frame_equal(sharded_links, links)
+
+def test_sharded_matches_single_process(prepared):
+    """Shards by postCode deduplicate like the whole data set."""
+    assert_sharded_matches(prepared, 3)
+
+def test_sharded_with_more_shards_than_postcodes(prepared):
+    """Empty shards and the shard of missing postCodes change nothing."""
+    postcodes = prepared['postCode'].value_counts().index[:2]
+    rows = prepared[prepared['postCode'].isin(postcodes)]
+    missing = rows.head(3).assign(postCode=None, subject=rows.head(3)['subject'] + '-nopc')
+    df = pd.concat([rows, missing], ignore_index=True)
+    df = df.astype({'postCode': prepared['postCode'].dtype})
+
+    assert df['postCode'].nunique() < 3 * 4
+    assert_sharded_matches(df, 3)
+
+def extract_pairs(names, threshold=90):
+    """The all-pairs process.extract loop fuzzy matching used to run."""
+    pairs = []
+    for name in names:
+        for match, score, _ in process.extract(name, names, scorer=fuzz.token_sort_ratio,
+                                               limit=len(names)):
+            if score >= threshold and name != match:
+                pairs.append((name, match))
+
+    return pairs
+
+# Single tokens of 18 letters score exactly 90 with 4 letters more and
+# below it with 5, on the edge of the length band; the others tie
+EDGE_NAMES = ['Cultuurcentrumzaal', 'Cultuurcentrumzaal Abc', 'Cultuurcentrumzaal Abcd',
+              'Abc Cultuurcentrumzaal', 'Zaal Noord', 'Zaal Nord', 'Zaal Noord 1',
+              'Zaal Noord 2', 'Noord Zaal']
+
+@pytest.mark.parametrize('source', ['edge', 'sample'])
+def test_fuzzy_pairs_match_extract(prepared, source):
+    """Length-band blocking finds the pairs of the all-pairs loop, in its order."""
+    names = EDGE_NAMES
+    if source == 'sample':
+        names = prepared['locationName'].dropna().unique().tolist() + EDGE_NAMES
+
+    pairs = ETLPipeline(None, None)._fuzzy_candidate_pairs(names)  # pylint: disable=protected-access
+
+    assert ('Cultuurcentrumzaal', 'Cultuurcentrumzaal Abc') in pairs
+    assert ('Cultuurcentrumzaal', 'Cultuurcentrumzaal Abcd') not in pairs
+    assert pairs == extract_pairs(names)
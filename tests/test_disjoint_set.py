@@ -0,0 +1,53 @@
+"""
+Tests of the array-backed disjoint-set forest.
+"""
+import time
+import numpy as np
+from lib.disjoint_set import DisjointSet
+
+def reference_roots(size, left, right):
+    """The smallest element of every set, with a union-find one pair at a time."""
+    parent = list(range(size))
+
+    def find(item):
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]
+            item = parent[item]
+        return item
+
+    for a, b in zip(left, right):
+        a, b = find(a), find(b)
+        parent[max(a, b)] = min(a, b)
+
+    return np.array([find(item) for item in range(size)])
+
+def test_random_links_match_reference():
+    """Batched unions give the same sets as merging the links one by one."""
+    rng = np.random.default_rng(0)
+    left, right = rng.integers(0, 5000, 3000), rng.integers(0, 5000, 3000)
+
+    forest = DisjointSet(5000)
+    forest.union(left, right)
+
+    np.testing.assert_array_equal(forest.find(np.arange(5000)),
+                                  reference_roots(5000, left, right))
+
+def test_long_chain_in_reverse_order():
+    """A chain hooked from its end collapses in near-linear time."""
+    size = 200_000
+    forest = DisjointSet(size)
+
+    start = time.perf_counter()
+    forest.union(np.arange(size - 1)[::-1], np.arange(1, size)[::-1])
+    elapsed = time.perf_counter() - start
+
+    assert (forest.find(np.arange(size)) == 0).all()
+    # One hop per pass took minutes here; doubling the pointers takes a fraction of a second
+    assert elapsed < 10
+
+def test_find_of_singletons():
+    """Elements without links are their own root."""
+    forest = DisjointSet(4)
+    forest.union([2], [3])
+
+    np.testing.assert_array_equal(forest.find(np.array([0, 1, 2, 3])), [0, 1, 2, 2])
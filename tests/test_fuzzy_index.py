@@ -0,0 +1,47 @@
+"""
+Tests that the fuzzy pair index gives the pairs of scoring every name, and stays bounded.
+"""
+import pytest
+from lib.etl_pipeline import ETLPipeline
+from lib.fuzzy_index import FuzzyPairIndex
+
+RUNS = [
+    ['Sporthal De Linde', 'Sporthal de Linde', 'Kerk', 'Zaal Noord', 'Zaal Nord'],
+    ['Zaal Noord', 'Zaal Nord', 'Zaal Noord 2', 'Bibliotheek', 'Bibliotheek Oost'],
+    ['Kerk', 'Kerk Zuid', 'Sporthal De Linde', 'Sporthal de Linden', 'Markt'],
+]
+
+def candidate_pairs(names, index=None):
+    """The fuzzy candidate pairs of a pipeline, with or without an index."""
+    pipeline = ETLPipeline(None, None)
+    pipeline.fuzzy_index = index
+    return pipeline._fuzzy_candidate_pairs(names)  # pylint: disable=protected-access
+
+@pytest.mark.parametrize('max_names', [1_000_000, 6])
+def test_index_matches_scoring_every_name(tmp_path, max_names):
+    """Every run gets the pairs of scoring its names from scratch, capped or not."""
+    for names in RUNS:
+        # A new instance per run reads the index the previous run wrote
+        index = FuzzyPairIndex(str(tmp_path), max_names=max_names)
+        assert candidate_pairs(names, index) == candidate_pairs(names)
+
+def test_index_keeps_only_current_names_past_cap(tmp_path):
+    """Past the cap the index holds the names of the last run and pairs among them."""
+    for names in RUNS:
+        index = FuzzyPairIndex(str(tmp_path), max_names=6)
+        candidate_pairs(names, index)
+
+    index = FuzzyPairIndex(str(tmp_path), max_names=6)
+    index.load()
+    assert sorted(index.names) == sorted(RUNS[-1])
+    assert len(index.pairs['first']) == len(candidate_pairs(RUNS[-1])) // 2
+    assert (index.pairs['first'] < index.pairs['second']).all()
+
+def test_index_grows_below_cap(tmp_path):
+    """Below the cap the names of earlier runs stay known."""
+    for names in RUNS:
+        candidate_pairs(names, FuzzyPairIndex(str(tmp_path)))
+
+    index = FuzzyPairIndex(str(tmp_path))
+    index.load()
+    assert set(index.names) == {name for names in RUNS for name in names}
@@ -0,0 +1,86 @@
+"""
+Tests of the GML projection, the grid index and nearby location pairs.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from lib.disjoint_set import DisjointSet
+from lib.etl_pipeline import ETLPipeline
+from lib.geometry import GridIndex, parse_points, wgs84_to_lambert72
+
+# Brussels Grand-Place in WGS 84 and Belgian Lambert 72
+BRUSSELS = (4.3517, 50.8466)
+BRUSSELS_LAMBERT = (148799, 170689)
+
+def test_projection_of_known_point():
+    """WGS 84 degrees land within a metre of the Lambert 72 coordinates."""
+    x, y = wgs84_to_lambert72(np.array([BRUSSELS[0]]), np.array([BRUSSELS[1]]))
+
+    assert x[0] == pytest.approx(BRUSSELS_LAMBERT[0], abs=1)
+    assert y[0] == pytest.approx(BRUSSELS_LAMBERT[1], abs=1)
+
+@pytest.mark.parametrize('gml', [
+    '<gml:Point srsName="http://www.opengis.net/def/crs/EPSG/0/4326">'
+    '<gml:pos>50.8466 4.3517</gml:pos></gml:Point>',
+    '<gml:Point srsName="http://www.opengis.net/def/crs/OGC/1.3/CRS84">'
+    '<gml:pos>4.3517 50.8466</gml:pos></gml:Point>',
+    '<gml:Point><gml:coordinates>4.3517,50.8466</gml:coordinates></gml:Point>',
+    '<gml:Point srsName="EPSG:31370"><gml:pos>148799 170689</gml:pos></gml:Point>',
+])
+def test_points_in_every_axis_order(gml):
+    """Geographic points in either axis order and Lambert 72 points agree."""
+    x, y = parse_points(pd.Series([gml]))
+
+    assert x[0] == pytest.approx(BRUSSELS_LAMBERT[0], abs=1)
+    assert y[0] == pytest.approx(BRUSSELS_LAMBERT[1], abs=1)
+
+def test_unusable_points_are_missing():
+    """Missing geometries and other reference systems have no coordinates."""
+    x, y = parse_points(pd.Series([None, '<gml:Point srsName="EPSG:3035">'
+                                   '<gml:pos>3900000 3100000</gml:pos></gml:Point>']))
+
+    assert np.isnan(x).all() and np.isnan(y).all()
+
+def brute_force_pairs(x, y, radius):
+    """The pairs (i, j) with i < j within the radius, from every distance."""
+    distances = np.hypot(x[:, None] - x[None, :], y[:, None] - y[None, :])
+    first, second = np.nonzero(np.triu(distances <= radius, k=1))
+    return set(zip(first.tolist(), second.tolist()))
+
+def test_grid_index_matches_brute_force():
+    """Pairs across cell edges, negative and co-located coordinates, no missing points."""
+    rng = np.random.default_rng(7)
+    x = np.concatenate([rng.uniform(-500, 500, 400), [0, 0, 0, 50, 50], [np.nan, 3]])
+    y = np.concatenate([rng.uniform(-500, 500, 400), [0, 0, 0, 50, np.nan], [4, np.nan]])
+    first, second = GridIndex(x, y, 50).pairs()
+
+    assert set(zip(first.tolist(), second.tolist())) == brute_force_pairs(x, y, 50)
+
+def clusters(pairs, rows):
+    """The connected rows of the pairs, as a sorted list of sorted row lists."""
+    forest = DisjointSet(rows)
+    for row, match in pairs:
+        forest.union(row, match)
+    roots = forest.find(np.arange(rows))
+
+    return sorted(sorted(np.flatnonzero(roots == root).tolist()) for root in np.unique(roots))
+
+def test_colocated_rows_do_not_pair_all_with_all():
+    """Rows at one point with one name pair linearly and link like all pairs would."""
+    gml = '<gml:Point srsName="EPSG:31370"><gml:pos>{} 170000</gml:pos></gml:Point>'
+    df = pd.DataFrame({
+        'subject': [f"s{row}" for row in range(203)],
+        'locationName': ['Sporthal De Linde'] * 200 + ['Sporthal de Linde', 'Kerk', ''],
+        'gml': [gml.format(150000)] * 200 + [gml.format(150010)] * 3})
+    unmatched = np.ones(len(df), dtype=bool)
+
+    pipeline = ETLPipeline(None, None)
+    pipeline.geo_radius = 50
+    pairs = pipeline._geospatial_pairs(  # pylint: disable=protected-access
+        df, unmatched, df['subject'].to_numpy(dtype=object))
+
+    assert len(pairs) < 2 * len(df)
+    assert clusters(zip(pairs['row'], pairs['match']), len(df)) == \
+        [list(range(201)), [201], [202]]
+    # Every row of the group has a match with its name at its point
+    assert (pairs.loc[pairs['row'].lt(200) & pairs['match'].lt(200), 'distance'] == 0).all()
@@ -0,0 +1,60 @@
+"""
+Tests that an incremental run on an unchanged input writes the full run's output.
+"""
+import os
+import pandas as pd
+import pytest
+from lib.etl_pipeline import ETLPipeline, hashes_path
+from lib.incremental_etl import IncrementalETL
+from lib.stage_pipeline import StagePipeline
+from lib.table_io import read_table
+
+SAMPLE = os.path.join(os.path.dirname(__file__), 'data', 'locations-1000.csv')
+
+def make_pipeline():
+    """A pipeline on the sample with the repository's mapping and quarantine list."""
+    return ETLPipeline(SAMPLE, 'conf/udbmappings.json', 'conf/to_remove.txt')
+
+@pytest.fixture(name='previous', scope='module')
+def fixture_previous(tmp_path_factory):
+    """The path of a full run's output for the sample."""
+    pipeline = make_pipeline()
+    for _ in StagePipeline(pipeline).run():
+        pass
+
+    output = str(tmp_path_factory.mktemp('full') / 'cleansed.csv')
+    pipeline.save_data(output)
+    return output
+
+def test_hashes_kept_next_to_output(previous):
+    """The output has no hash column; the side file has a hash per subject."""
+    output = read_table(previous)
+    hashes = read_table(hashes_path(previous))
+
+    assert 'content_hash' not in output
+    assert list(hashes.columns) == ['subject', 'content_hash']
+    assert hashes['subject'].tolist() == output['subject'].tolist()
+
+@pytest.mark.parametrize('extension', ['csv', 'parquet'])
+def test_unchanged_input_matches_full_run(previous, tmp_path, extension):
+    """Without input changes, nothing is redone and the output is the full run's."""
+    if extension == 'parquet':
+        pipeline = ETLPipeline(previous, None)
+        pipeline.data = pd.concat([read_table(previous), read_table(hashes_path(previous))
+                                   .drop(columns='subject')], axis=1)
+        previous = str(tmp_path / 'previous.parquet')
+        pipeline.save_data(previous)
+
+    pipeline = make_pipeline()
+    for _ in StagePipeline(pipeline).run(until_stage='group'):
+        pass
+    counts = IncrementalETL(pipeline).run(previous)
+
+    output = str(tmp_path / 'cleansed.csv')
+    pipeline.save_data(output)
+
+    assert counts['new'] == counts['changed'] == counts['removed'] == 0
+    assert counts['recomputed'] == 0
+    pd.testing.assert_frame_equal(read_table(output), read_table(previous))
+    pd.testing.assert_frame_equal(read_table(hashes_path(output)),
+                                  read_table(hashes_path(previous)))
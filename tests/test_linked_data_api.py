@@ -0,0 +1,24 @@
+"""
+Tests of the page order of paged SPARQL queries.
+"""
+from lib.linked_data_api import LinkedDataAPI, projected_variables
+
+def test_projection_with_aliases():
+    """Aliased aggregates count by their alias, plain variables as they are."""
+    query = """
+        SELECT ?subject (SAMPLE(?inName) AS ?locationName) (SAMPLE(?inCity) AS ?city)
+        WHERE { ?subject ?p ?inName . OPTIONAL { ?subject ?q ?inCity } }
+        GROUP BY ?subject
+    """
+    assert projected_variables(query) == ['subject', 'locationName', 'city']
+
+def test_projection_of_select_star():
+    """SELECT * returns every variable of the pattern."""
+    assert projected_variables("SELECT * WHERE { GRAPH ?g { ?s ?p ?o } }") == ['g', 's', 'p', 'o']
+
+def test_pages_are_ordered_by_every_variable():
+    """Rows sharing a subject are ordered by the other variables as well."""
+    api = LinkedDataAPI.__new__(LinkedDataAPI)
+    api.query = "SELECT DISTINCT ?locationName ?subject ?postCode WHERE { ?subject ?p ?o }"
+
+    assert api._page_order() == '?subject ?locationName ?postCode'  # pylint: disable=protected-access
@@ -0,0 +1,116 @@
+"""
+Tests of the commands in main: fetches against the mock SPARQL endpoint and
+the worker protocol.
+"""
+import json
+import os
+import subprocess
+import sys
+import httpx
+import pandas as pd
+import pytest
+import main
+from bench.mock_endpoint import MockEndpoint
+from lib import linked_data_api
+from lib.etl_pipeline import hashes_path
+from lib.table_io import read_table
+
+SAMPLE = os.path.join(os.path.dirname(__file__), 'data', 'locations-1000.csv')
+QUERY = '?subject ?p ?locationName .'
+
+class LocalAPI(linked_data_api.LinkedDataAPI):
+    """An API on a plain client that does not wait between retries."""
+
+    def __init__(self, client=None):
+        super().__init__(client or httpx.Client())
+        self.backoff = 0
+
+@pytest.fixture(name='endpoint')
+def fixture_endpoint(monkeypatch):
+    """A mock endpoint serving sample rows as the product 'mock'."""
+    rows = read_table(SAMPLE).head(120)[['subject', 'locationName', 'postCode']]
+    with MockEndpoint(rows) as endpoint:
+        monkeypatch.setattr(linked_data_api, 'LinkedDataAPI', LocalAPI)
+        monkeypatch.setitem(main.endpoints, 'mock', endpoint.url)
+        monkeypatch.setitem(main.queries, 'mock', QUERY)
+        yield endpoint
+
+def fetch_args(*argv):
+    """The parsed arguments of a fetch of the mock product."""
+    return main.make_parser().parse_args(['-p', 'mock', '--no-cache', *argv])
+
+def test_paged_fetch_retries_and_stops_at_short_page(endpoint, tmp_path):
+    """A 503 is retried, and the short last page ends the fetch with every row."""
+    endpoint.failures = [503]
+    output = str(tmp_path / 'mock.csv')
+    main.fetch_product(fetch_args('--page-size', '50', '--workers', '1', '-f', output))
+
+    pages = [query for query, _ in endpoint.requests if 'OFFSET' in query]
+    assert [query.split()[-1] for query in pages] == ['0', '0', '50', '100']
+    pd.testing.assert_frame_equal(read_table(output), read_table(SAMPLE).head(120)
+                                  [['subject', 'locationName', 'postCode']])
+
+def test_paged_fetch_error_fails_the_product(endpoint, tmp_path):
+    """An HTTP error on a page is reported as a failed fetch, without a partial file."""
+    endpoint.failures = [404]
+    output = str(tmp_path / 'mock.csv')
+
+    with pytest.raises(RuntimeError, match='Fetching mock failed'):
+        main.fetch_product(fetch_args('--page-size', '50', '-f', output))
+    assert not os.path.exists(output)
+
+def test_worker_reports_every_job(tmp_path):
+    """A worker answers ready, then one status line per job, and goes on after a bad one."""
+    parts = [tmp_path / 'first.csv', tmp_path / 'second.csv']
+    parts[0].write_text('subject,locationName\ns1,Zaal\n', encoding='utf-8')
+    parts[1].write_text('subject,locationName\ns2,Hal\n', encoding='utf-8')
+    output = tmp_path / 'merged.csv'
+    jobs = [f"--merge {parts[0]} {parts[1]} -f {output}",
+            '--no-such-option',
+            '',
+            f"--etl cji -i {tmp_path / 'missing.csv'}",
+            f"--merge {parts[1]} -f {tmp_path / 'single.csv'}"]
+
+    worker = subprocess.run([sys.executable, 'main.py', '--worker'], input='\n'.join(jobs) + '\n',
+                            capture_output=True, text=True, timeout=120, check=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    statuses = [json.loads(line) for line in worker.stdout.splitlines()]
+
+    assert statuses[0] == {'status': 'ready'}
+    assert [(status['job'], status['status']) for status in statuses[1:]] == \
+        [(1, 'ok'), (2, 'error'), (4, 'error'), (5, 'ok')]
+    assert statuses[2]['error'].startswith('invalid arguments')
+    assert statuses[3]['error'].startswith('FileNotFoundError')
+    assert all(status['seconds'] >= 0 for status in statuses[1:])
+    assert read_table(str(output))['subject'].tolist() == ['s1', 's2']
+
+@pytest.fixture(name='products')
+def fixture_products(monkeypatch):
+    """Two mock endpoints serving halves of the sample as the only products."""
+    rows = read_table(SAMPLE)
+    with MockEndpoint(rows.iloc[:600]) as first, MockEndpoint(rows.iloc[600:]) as second:
+        monkeypatch.setattr(linked_data_api, 'LinkedDataAPI', LocalAPI)
+        monkeypatch.setattr(main, 'endpoints', {'first': first.url, 'second': second.url})
+        monkeypatch.setattr(main, 'queries', {'first': QUERY, 'second': QUERY})
+        yield
+
+@pytest.mark.parametrize('page_size', [[], ['--page-size', '150']])
+def test_streaming_run_matches_fetch_then_etl(products, tmp_path, page_size):
+    """--run writes what --all, --merge and --etl write one after the other."""
+    # pylint: disable=unused-argument
+    def run(*argv):
+        main.run(main.make_parser().parse_args([*argv, '--no-cache', *page_size]))
+
+    run('--run', '-f', str(tmp_path / 'streamed.csv'))
+
+    run('--all', '-o', str(tmp_path))
+    run('--merge', str(tmp_path / 'first.csv'), str(tmp_path / 'second.csv'),
+        '-f', str(tmp_path / 'merged.csv'))
+    run('--etl', 'cji', '-i', str(tmp_path / 'merged.csv'), '-f', str(tmp_path / 'batch.csv'))
+
+    for name in ['streamed', 'batch']:
+        assert read_table(str(tmp_path / f"{name}.csv"))['subject'].is_unique
+    pd.testing.assert_frame_equal(read_table(str(tmp_path / 'streamed.csv')),
+                                  read_table(str(tmp_path / 'batch.csv')))
+    pd.testing.assert_frame_equal(read_table(hashes_path(str(tmp_path / 'streamed.csv'))),
+                                  read_table(hashes_path(str(tmp_path / 'batch.csv'))))
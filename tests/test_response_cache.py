@@ -0,0 +1,105 @@
+"""
+Tests of the response cache against the mock SPARQL endpoint: warm fetches,
+TTL, revalidation, the row count probe and eviction.
+"""
+import os
+import httpx
+import pandas as pd
+import pytest
+from bench.mock_endpoint import MockEndpoint
+from lib.linked_data_api import LinkedDataAPI
+from lib.response_cache import ResponseCache
+from lib.table_io import read_table
+
+SAMPLE = os.path.join(os.path.dirname(__file__), 'data', 'locations-1000.csv')
+QUERY = 'SELECT ?subject ?locationName ?postCode WHERE { ?subject ?p ?o }'
+
+@pytest.fixture(name='rows', scope='module')
+def fixture_rows():
+    """Sample rows with unbound values in some columns."""
+    return read_table(SAMPLE).head(120)
+
+def make_api(client, endpoint, cache):
+    """An API for the endpoint that does not wait between retries."""
+    api = LinkedDataAPI(client)
+    api.set_data_endpoint(endpoint.url)
+    api.set_query(QUERY)
+    api.set_cache(cache)
+    api.backoff = 0
+    return api
+
+def test_warm_fetch_equals_cold_fetch(rows, tmp_path):
+    """A cache hit returns the frame a download does, missing values included."""
+    with MockEndpoint(rows) as endpoint, httpx.Client() as client:
+        api = make_api(client, endpoint, ResponseCache(str(tmp_path)))
+        cold = api.fetch_data()
+        warm = api.fetch_data()
+
+    assert len(endpoint.requests) == 1
+    assert cold['gml'].isna().any()
+    pd.testing.assert_frame_equal(warm, cold)
+
+def test_fresh_entry_is_served_without_request(rows, tmp_path):
+    """Within the TTL the endpoint is not asked at all."""
+    with MockEndpoint(rows, etag='"v1"') as endpoint, httpx.Client() as client:
+        api = make_api(client, endpoint, ResponseCache(str(tmp_path), ttl=3600))
+        api.fetch_data()
+        api.fetch_data()
+
+    assert len(endpoint.requests) == 1
+
+def test_revalidation_with_etag(rows, tmp_path):
+    """Past the TTL an unchanged result comes back 304, a changed one in full."""
+    with MockEndpoint(rows, etag='"v1"') as endpoint, httpx.Client() as client:
+        api = make_api(client, endpoint, ResponseCache(str(tmp_path), ttl=0))
+        first = api.fetch_data()
+
+        unchanged = api.fetch_data()
+        assert endpoint.requests[-1][1].get('If-None-Match') == '"v1"'
+        pd.testing.assert_frame_equal(unchanged, first)
+
+        endpoint.set_data(rows.head(50), etag='"v2"')
+        changed = api.fetch_data()
+
+    assert len(changed) == 50
+    assert len(endpoint.requests) == 3
+
+def test_paged_revalidation_uses_count_probe(rows, tmp_path):
+    """Paged results are revalidated with a row count, then downloaded in pages again."""
+    with MockEndpoint(rows, etag='"v1"') as endpoint, httpx.Client() as client:
+        api = make_api(client, endpoint, ResponseCache(str(tmp_path), ttl=0))
+        first = api.fetch_data(page_size=50, workers=2)
+        pages = len(endpoint.requests)
+
+        unchanged = api.fetch_data(page_size=50, workers=2)
+        assert len(endpoint.requests) == pages + 1
+        assert 'COUNT(*)' in endpoint.requests[-1][0]
+        pd.testing.assert_frame_equal(unchanged, first)
+
+        endpoint.set_data(rows.head(70))
+        changed = api.fetch_data(page_size=50, workers=2)
+
+    # No request of a revalidation is an unpaged download of the whole result
+    assert all('LIMIT' in query or 'COUNT(*)' in query for query, _ in endpoint.requests)
+    assert len(changed) == 70
+
+def test_eviction_keeps_the_cache_under_its_limit(rows, tmp_path):
+    """The least recently used entries go once the cache outgrows max_bytes."""
+    cache = ResponseCache(str(tmp_path))
+    cache.put('old', rows, {})
+    size = os.path.getsize(tmp_path / 'old.parquet')
+    os.utime(tmp_path / 'old.parquet', (0, 0))
+
+    cache.max_bytes = size * 3 // 2
+    cache.put('new', rows, {})
+
+    assert cache.get('old') is None
+    pd.testing.assert_frame_equal(cache.get('new')[0], rows)
+
+def test_eviction_tolerates_entries_removed_meanwhile(rows, tmp_path, monkeypatch):
+    """An entry another fetch evicted between listing and stat is skipped."""
+    cache = ResponseCache(str(tmp_path), max_bytes=1)
+    listdir = os.listdir
+    monkeypatch.setattr(os, 'listdir', lambda path: [*listdir(path), 'gone.parquet'])
+
+    cache.put('entry', rows, {})
@@ -0,0 +1,52 @@
+"""
+Tests of the streaming SPARQL result parsers on encoded results split into
+chunks at awkward places.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from bench.mock_endpoint import chunked, encode_results
+from lib.sparql_results import parse_results
+
+FORMATS = ['json', 'csv', 'tsv']
+
+@pytest.fixture(name='rows')
+def fixture_rows():
+    """Rows with unbound values, multi-byte characters, quotes, tabs and newlines."""
+    return pd.DataFrame({
+        'subject': ['https://example.be/id/1', 'https://example.be/id/2',
+                    'https://example.be/id/3', 'https://example.be/id/4'],
+        'locationName': ['Café ’t Hof', 'Zaal "De Kroon"', np.nan, 'Tab\there, new\nline'],
+        'postCode': ['2000', np.nan, '9000', '8000'],
+        'bron': [np.nan, np.nan, np.nan, np.nan],
+        'gml': ['<gml:Point srsName="x"><gml:pos>4.1 50.2</gml:pos></gml:Point>',
+                'back\\slash', np.nan, 'ünïcödé ✓'],
+    }).astype('str')
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 64, 1 << 16])
+@pytest.mark.parametrize('result_format', FORMATS)
+def test_formats_parse_to_the_same_frame(rows, result_format, size):
+    """Every format and chunking gives the rows back, unbound values as NaN."""
+    parsed = parse_results(chunked(encode_results(rows, result_format), size), result_format)
+
+    pd.testing.assert_frame_equal(parsed, rows)
+
+def test_unbound_values_are_missing_in_every_format(rows):
+    """No format turns an unbound variable into an empty string."""
+    frames = [parse_results(chunked(encode_results(rows, result_format), 5), result_format)
+              for result_format in FORMATS]
+
+    for frame in frames:
+        assert frame['bron'].isna().all()
+        assert not frame.eq('').any().any()
+    pd.testing.assert_frame_equal(frames[1], frames[0])
+    pd.testing.assert_frame_equal(frames[2], frames[0])
+
+@pytest.mark.parametrize('result_format', ['json', 'tsv'])
+def test_empty_literals_stay_empty(result_format):
+    """JSON and TSV tell an empty literal from an unbound variable."""
+    rows = pd.DataFrame({'subject': ['a', 'b'], 'name': ['', np.nan]}).astype('str')
+    parsed = parse_results(chunked(encode_results(rows, result_format), 3), result_format)
+
+    assert parsed['name'].iloc[0] == ''
+    assert pd.isna(parsed['name'].iloc[1])
@@ -0,0 +1,85 @@
+"""
+Tests that resuming from checkpoints writes what a full run does, and that
+the checkpoint keys follow every setting a stage depends on.
+"""
+import os
+import shutil
+import pandas as pd
+import pytest
+from lib.etl_pipeline import ETLPipeline
+from lib.stage_pipeline import STAGE_NAMES, StagePipeline
+
+SAMPLE = os.path.join(os.path.dirname(__file__), 'data', 'locations-1000.csv')
+
+def make_pipeline(mapping_json='conf/udbmappings.json', quarantine_txt='conf/to_remove.txt'):
+    """A pipeline on the sample, by default with the repository's configuration."""
+    return ETLPipeline(SAMPLE, mapping_json, quarantine_txt)
+
+def run_stages(checkpoint_dir, from_stage=None, until_stage=None):
+    """The data after running the stages on a new pipeline."""
+    pipeline = make_pipeline()
+    for _ in StagePipeline(pipeline, checkpoint_dir).run(from_stage, until_stage):
+        pass
+
+    return pipeline.data.reset_index(drop=True)
+
+@pytest.fixture(name='full_run', scope='module')
+def fixture_full_run():
+    """The data after all stages without checkpoints."""
+    return run_stages(None)
+
+@pytest.mark.parametrize('stage', STAGE_NAMES[1:])
+def test_resume_matches_full_run(full_run, tmp_path, stage):
+    """Stopping before a stage and resuming at it gives the full run's output."""
+    position = STAGE_NAMES.index(stage)
+    run_stages(str(tmp_path), until_stage=STAGE_NAMES[position - 1])
+    assert StagePipeline(make_pipeline(), str(tmp_path)).can_start_at(stage)
+
+    pd.testing.assert_frame_equal(run_stages(str(tmp_path), from_stage=stage), full_run)
+
+def test_until_stage_matches_full_run(tmp_path):
+    """A run stopped at a stage has the data of a full run at that stage."""
+    stopped = run_stages(str(tmp_path), until_stage='group')
+    checkpoint = StagePipeline(make_pipeline(), str(tmp_path)).checkpoint('group')
+
+    pd.testing.assert_frame_equal(pd.read_feather(checkpoint), stopped)
+    assert not StagePipeline(make_pipeline(), str(tmp_path)).can_start_at('fill')
+
+def test_checkpoints_off_without_directory():
+    """Without a checkpoint directory no run can resume after the first stage."""
+    stages = StagePipeline(make_pipeline())
+    assert stages.can_start_at('load')
+    assert not stages.can_start_at('filter')
+
+def changed_from(stages, changed):
+    """The first stage whose key differs between two stage pipelines."""
+    return next((name for name, before, after in zip(STAGE_NAMES, stages.keys(), changed.keys())
+                 if before != after), None)
+
+def test_keys_follow_settings(tmp_path):
+    """Every setting a stage depends on changes its key and the keys after it."""
+    mapping = tmp_path / 'udbmappings.json'
+    quarantine = tmp_path / 'to_remove.txt'
+    shutil.copy('conf/udbmappings.json', mapping)
+    shutil.copy('conf/to_remove.txt', quarantine)
+
+    def stages(**settings):
+        pipeline = make_pipeline(str(mapping), str(quarantine))
+        for name, value in settings.items():
+            setattr(pipeline, name, value)
+        return StagePipeline(pipeline)
+
+    reference = stages()
+    assert changed_from(reference, stages()) is None
+    assert changed_from(reference, stages(categorical=False)) == 'load'
+    assert changed_from(reference, stages(aggregations={'locationName': 'concat_distinct'})) \
+        == 'group'
+    assert changed_from(reference, stages(geo_radius=50)) == 'dedup'
+    assert changed_from(stages(geo_radius=50), stages(geo_radius=50, geo_name_threshold=90)) \
+        == 'dedup'
+
+    quarantine.write_text(quarantine.read_text(encoding='utf-8') + 'extra\n', encoding='utf-8')
+    assert changed_from(reference, stages()) == 'remove'
+
+    mapping.write_text(mapping.read_text(encoding='utf-8') + '\n', encoding='utf-8')
+    assert changed_from(reference, stages()) == 'filter'